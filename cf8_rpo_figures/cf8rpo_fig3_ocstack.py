@@ -17,7 +17,6 @@
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-from composition_stats import closure
 import pyleoclim as pyleo
 from pylipd.lipd import LiPD
 import cf8rpo_functions as cf8_fun
@@ -30,132 +29,51 @@ plt.rcParams['font.family'] = "Liberation Sans"
 
 
 # Import data from LiPD files
-s1_conc_ens, s1_conc = cf8_fun.getlipd(
+(
+    (s1_conc_ens, s1_conc),
+    (s2_conc_ens, s2_conc),
+    (s3_conc_ens, s3_conc),
+    (s4_conc_ens, s4_conc),
+    (s5_conc_ens, s5_conc),
+    (s1_fm_ens, s1_fm),
+    (s2_fm_ens, s2_fm),
+    (s3_fm_ens, s3_fm),
+    (s4_fm_ens, s4_fm),
+    (s5_fm_ens, s5_fm),
+    (rpo_dbd_ens, rpo_dbd),
+    (rpo_dbdstdev_ens, rpo_dbdstdev),
+    (rpo_acc_ens, rpo_acc),
+    (rpo_toc_ens, rpo_toc),
+    (mix_aqua_ens, mix_aqua),
+    (mix_aquastdev_ens, mix_aquastdev),
+    (mix_post_ens, mix_post),
+    (mix_poststdev_ens, mix_poststdev),
+    (mix_mis5_ens, mix_mis5),
+    (mix_mi5stdev_ens, mix_mis5stdev)
+) = cf8_fun.getlipd_many(
     'Lindberg.CF8.2024.lpd',
-    paleoData_variableName='split1concentration',
-    depth_name='RPOdepth',
-    val_unit='umol'
-)
-s2_conc_ens, s2_conc = cf8_fun.getlipd(
-    'Lindberg.CF8.2024.lpd',
-    paleoData_variableName='split2concentration',
-    depth_name='RPOdepth',
-    val_unit='umol'
-)
-s3_conc_ens, s3_conc = cf8_fun.getlipd(
-    'Lindberg.CF8.2024.lpd',
-    paleoData_variableName='split3concentration',
-    depth_name='RPOdepth',
-    val_unit='umol'
-)
-s4_conc_ens, s4_conc = cf8_fun.getlipd(
-    'Lindberg.CF8.2024.lpd',
-    paleoData_variableName='split4concentration',
-    depth_name='RPOdepth',
-    val_unit='umol'
-)
-s5_conc_ens, s5_conc = cf8_fun.getlipd(
-    'Lindberg.CF8.2024.lpd',
-    paleoData_variableName='split5concentration',
-    depth_name='RPOdepth',
-    val_unit='umol'
-)
-
-s1_fm_ens, s1_fm = cf8_fun.getlipd(
-    'Lindberg.CF8.2024.lpd',
-    paleoData_variableName='split1fractionModern',
-    depth_name='RPOdepth',
-    val_unit ='unitless'
-)
-s2_fm_ens, s2_fm = cf8_fun.getlipd(
-    'Lindberg.CF8.2024.lpd',
-    paleoData_variableName='split2fractionModern',
-    depth_name='RPOdepth',
-    val_unit ='unitless'
-)
-s3_fm_ens, s3_fm = cf8_fun.getlipd(
-    'Lindberg.CF8.2024.lpd',
-    paleoData_variableName='split3fractionModern',
-    depth_name='RPOdepth',
-    val_unit ='unitless'
-)
-s4_fm_ens, s4_fm = cf8_fun.getlipd(
-    'Lindberg.CF8.2024.lpd',
-    paleoData_variableName='split4fractionModern',
-    depth_name='RPOdepth',
-    val_unit ='unitless'
-)
-s5_fm_ens, s5_fm = cf8_fun.getlipd(
-    'Lindberg.CF8.2024.lpd',
-    paleoData_variableName='split5fractionModern',
-    depth_name='RPOdepth',
-    val_unit ='unitless'
-)
-
-rpo_dbd_ens, rpo_dbd = cf8_fun.getlipd(
-    'Lindberg.CF8.2024.lpd',
-    paleoData_variableName='dryBulkDensity',
-    depth_name='RPOdepth',
-    val_unit='g/cm3'
-)
-rpo_dbdstdev_ens, rpo_dbdstdev = cf8_fun.getlipd(
-    'Lindberg.CF8.2024.lpd',
-    paleoData_variableName='dryBulkDensityStdev',
-    depth_name='RPOdepth',
-    val_unit='g/cm3'
-)
-
-rpo_acc_ens, rpo_acc = cf8_fun.getlipd(
-    'Lindberg.CF8.2024.lpd',
-    paleoData_variableName='accumulation',
-    depth_name='RPOdepth',
-    val_unit='cm/yr'
-)
-
-rpo_toc_ens, rpo_toc = cf8_fun.getlipd(
-    'Lindberg.CF8.2024.lpd',
-    paleoData_variableName='RPOtotalOrganicCarbon',
-    depth_name='RPOdepth',
-    val_unit='percent'
-)
-
-mix_aqua_ens, mix_aqua = cf8_fun.getlipd(
-    'Lindberg.CF8.2024.lpd',
-    paleoData_variableName='mixsiarAquatic',
-    depth_name='RPOdepth',
-    val_unit='fraction'
-)
-mix_aquastdev_ens, mix_aquastdev = cf8_fun.getlipd(
-    'Lindberg.CF8.2024.lpd',
-    paleoData_variableName='mixsiarAquaticStdev',
-    depth_name='RPOdepth',
-    val_unit='fraction'
-)
-
-mix_post_ens, mix_post = cf8_fun.getlipd(
-    'Lindberg.CF8.2024.lpd',
-    paleoData_variableName='mixsiarPostglacial',
-    depth_name='RPOdepth',
-    val_unit='fraction'
-)
-mix_poststdev_ens, mix_poststdev = cf8_fun.getlipd(
-    'Lindberg.CF8.2024.lpd',
-    paleoData_variableName='mixsiarPostglacialStdev',
-    depth_name='RPOdepth',
-    val_unit='fraction'
-)
-
-mix_mis5_ens, mix_mis5 = cf8_fun.getlipd(
-    'Lindberg.CF8.2024.lpd',
-    paleoData_variableName='mixsiarMIS5',
-    depth_name='RPOdepth',
-    val_unit='fraction'
-)
-mix_mi5stdev_ens, mix_mis5stdev = cf8_fun.getlipd(
-    'Lindberg.CF8.2024.lpd',
-    paleoData_variableName='mixsiarMIS5Stdev',
-    depth_name='RPOdepth',
-    val_unit='fraction'
+    [
+        ('split1concentration', 'RPOdepth', 'umol'),
+        ('split2concentration', 'RPOdepth', 'umol'),
+        ('split3concentration', 'RPOdepth', 'umol'),
+        ('split4concentration', 'RPOdepth', 'umol'),
+        ('split5concentration', 'RPOdepth', 'umol'),
+        ('split1fractionModern', 'RPOdepth', 'unitless'),
+        ('split2fractionModern', 'RPOdepth', 'unitless'),
+        ('split3fractionModern', 'RPOdepth', 'unitless'),
+        ('split4fractionModern', 'RPOdepth', 'unitless'),
+        ('split5fractionModern', 'RPOdepth', 'unitless'),
+        ('dryBulkDensity', 'RPOdepth', 'g/cm3'),
+        ('dryBulkDensityStdev', 'RPOdepth', 'g/cm3'),
+        ('accumulation', 'RPOdepth', 'cm/yr'),
+        ('RPOtotalOrganicCarbon', 'RPOdepth', 'percent'),
+        ('mixsiarAquatic', 'RPOdepth', 'fraction'),
+        ('mixsiarAquaticStdev', 'RPOdepth', 'fraction'),
+        ('mixsiarPostglacial', 'RPOdepth', 'fraction'),
+        ('mixsiarPostglacialStdev', 'RPOdepth', 'fraction'),
+        ('mixsiarMIS5', 'RPOdepth', 'fraction'),
+        ('mixsiarMIS5Stdev', 'RPOdepth', 'fraction')
+    ]
 )
 
 
@@ -194,24 +112,33 @@ co2_yield = np.array(co2_df)
 fm_arr = np.array(fm_df)
 
 # Convert RPO CO2 split concentrations to inverse cummulative yield
-icy = np.zeros(np.shape(np.array(co2_yield)))
-for i in range(0, np.shape(icy)[0]):
-    for j in range(0, np.shape(icy)[1]):
-        icy[i, j] = 1/(np.sum(co2_yield[i, 0:j+1]))
-
-co2_frac = closure(co2_yield)
-icy_yint = np.zeros(np.shape(icy)[0])
+icy = cf8_fun.inverse_cumulative_yield(co2_yield)
 
 # Calculate RPO CO2 concentration-weighted average Fm
-fm_bulk = np.zeros(np.shape(icy)[0])
-for i in range(0, np.shape(fm_bulk)[0]):
-    fm_bulk[i] = np.sum(co2_frac[i,:]*fm_arr[i,:])/np.sum(co2_frac[i,:])
-
-# Calculate total OC mass accumulation rate
-# To be multiplied by endmember MixSIAR % contributions in Figure 3c
-oc_acc_mean = (rpo_dbd.paleoData_values*(rpo_toc.paleoData_values*0.01)*rpo_acc.paleoData_values)*(1e4)
-oc_acc_psd = ((rpo_dbd.paleoData_values+rpo_dbdstdev.paleoData_values)*(rpo_toc.paleoData_values*0.01)*rpo_acc.paleoData_values)*(1e4)
-oc_acc_msd = ((rpo_dbd.paleoData_values-rpo_dbdstdev.paleoData_values)*(rpo_toc.paleoData_values*0.01)*rpo_acc.paleoData_values)*(1e4)
+fm_bulk = cf8_fun.fm_bulk(co2_yield, fm_arr)
+
+# Monte Carlo OC mass accumulation rates of each MixSIAR endmember
+# Dry bulk density and MixSIAR % contributions are drawn from their mean +- stdev
+# Median and 95% range plotted in Figure 3c
+oc_acc_total, oc_acc_qs = cf8_fun.oc_accumulation_mc(
+    dbd=rpo_dbd.paleoData_values,
+    dbd_sd=rpo_dbdstdev.paleoData_values,
+    toc=rpo_toc.paleoData_values,
+    acc=rpo_acc.paleoData_values,
+    fractions=[
+        mix_aqua.paleoData_values,
+        mix_post.paleoData_values,
+        mix_mis5.paleoData_values
+    ],
+    fractions_sd=[
+        mix_aquastdev.paleoData_values,
+        mix_poststdev.paleoData_values,
+        mix_mis5stdev.paleoData_values
+    ],
+    n_draws=100000,
+    seed=2024
+)
+oc_acc_aqua, oc_acc_post, oc_acc_mis5 = oc_acc_qs
 
 
 # Figure 3 a-c script
@@ -285,62 +212,62 @@ ax.set_ylabel('MixSIAR % Contribution')
 # Figure 3c: Endmember OC accumulation rates
 ax = axs[2]
 ax.plot(
-    mix_aqua.ageMedian, (oc_acc_mean*mix_aqua.paleoData_values),
+    mix_aqua.ageMedian, oc_acc_aqua[1],
     color='blue', linestyle='-', linewidth=1, marker='o', markersize=4,
     label='Aquatic'
 )
 ax.plot(
-    mix_aqua.ageMedian, (oc_acc_msd*(mix_aqua.paleoData_values-mix_aquastdev.paleoData_values)),
+    mix_aqua.ageMedian, oc_acc_aqua[0],
     color='blue', linewidth=0
 )
 ax.plot(
-    mix_aqua.ageMedian, (oc_acc_psd*(mix_aqua.paleoData_values+mix_aquastdev.paleoData_values)),
+    mix_aqua.ageMedian, oc_acc_aqua[2],
     color='blue', linewidth=0
 )
 ax.fill_between(
     mix_aqua.ageMedian,
-    (oc_acc_msd*(mix_aqua.paleoData_values-mix_aquastdev.paleoData_values)),
-    (oc_acc_psd*(mix_aqua.paleoData_values+mix_aquastdev.paleoData_values)),
+    oc_acc_aqua[0],
+    oc_acc_aqua[2],
     color='blue', alpha=0.15, linewidth=0
 )
 
 ax.plot(
-    mix_post.ageMedian, (oc_acc_mean*mix_post.paleoData_values),
+    mix_post.ageMedian, oc_acc_post[1],
     color='orange', linestyle='-', linewidth=1, marker='o', markersize=4,
     label='Postglacial'
 )
 ax.plot(
-    mix_post.ageMedian, (oc_acc_msd*(mix_post.paleoData_values-mix_poststdev.paleoData_values)),
+    mix_post.ageMedian, oc_acc_post[0],
     color='orange', linewidth=0
 )
 ax.plot(
-    mix_post.ageMedian, (oc_acc_psd*(mix_post.paleoData_values+mix_poststdev.paleoData_values)),
+    mix_post.ageMedian, oc_acc_post[2],
     color='orange', linewidth=0
 )
 ax.fill_between(
     mix_post.ageMedian,
-    (oc_acc_msd*(mix_post.paleoData_values-mix_poststdev.paleoData_values)),
-    (oc_acc_psd*(mix_post.paleoData_values+mix_poststdev.paleoData_values)),
+    oc_acc_post[0],
+    oc_acc_post[2],
     color='orange', alpha=0.15, linewidth=0
 )
 
 ax.plot(
-    mix_mis5.ageMedian, (oc_acc_mean*mix_mis5.paleoData_values),
+    mix_mis5.ageMedian, oc_acc_mis5[1],
     color='black', linestyle='-', linewidth=1, marker='o', markersize=4,
     label='MIS 5'
 )
 ax.plot(
-    mix_mis5.ageMedian, (oc_acc_msd*(mix_mis5.paleoData_values-mix_mis5stdev.paleoData_values)),
+    mix_mis5.ageMedian, oc_acc_mis5[0],
     color='black', linewidth=0
 )
 ax.plot(
-    mix_mis5.ageMedian, (oc_acc_psd*(mix_mis5.paleoData_values+mix_mis5stdev.paleoData_values)),
+    mix_mis5.ageMedian, oc_acc_mis5[2],
     color='black', linewidth=0
 )
 ax.fill_between(
     mix_mis5.ageMedian,
-    (oc_acc_msd*(mix_mis5.paleoData_values-mix_mis5stdev.paleoData_values)),
-    (oc_acc_psd*(mix_mis5.paleoData_values+mix_mis5stdev.paleoData_values)),
+    oc_acc_mis5[0],
+    oc_acc_mis5[2],
     color='black', alpha=0.15, linewidth=0
 )
 
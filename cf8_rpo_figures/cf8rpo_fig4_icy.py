@@ -16,9 +16,6 @@
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-from sklearn.linear_model import LinearRegression
-import scipy.stats
-from composition_stats import closure
 import pyleoclim as pyleo
 from pylipd.lipd import LiPD
 import cf8rpo_functions as cf8_fun
@@ -31,73 +28,43 @@ plt.rcParams['font.family'] = "Liberation Sans"
 
 
 # Import data from LiPD files
-s1_conc_ens, s1_conc = cf8_fun.getlipd(
+(
+    (s1_conc_ens, s1_conc),
+    (s2_conc_ens, s2_conc),
+    (s3_conc_ens, s3_conc),
+    (s4_conc_ens, s4_conc),
+    (s5_conc_ens, s5_conc),
+    (s1_fm_ens, s1_fm),
+    (s2_fm_ens, s2_fm),
+    (s3_fm_ens, s3_fm),
+    (s4_fm_ens, s4_fm),
+    (s5_fm_ens, s5_fm),
+    (s1_fmunc_ens, s1_fmunc),
+    (s2_fmunc_ens, s2_fmunc),
+    (s3_fmunc_ens, s3_fmunc),
+    (s4_fmunc_ens, s4_fmunc),
+    (s5_fmunc_ens, s5_fmunc),
+    (rpo_depth_ens, rpo_depth)
+) = cf8_fun.getlipd_many(
     'Lindberg.CF8.2024.lpd',
-    paleoData_variableName='split1concentration',
-    depth_name='RPOdepth',
-    val_unit='umol'
-)
-s2_conc_ens, s2_conc = cf8_fun.getlipd(
-    'Lindberg.CF8.2024.lpd',
-    paleoData_variableName='split2concentration',
-    depth_name='RPOdepth',
-    val_unit='umol'
-)
-s3_conc_ens, s3_conc = cf8_fun.getlipd(
-    'Lindberg.CF8.2024.lpd',
-    paleoData_variableName='split3concentration',
-    depth_name='RPOdepth',
-    val_unit='umol'
-)
-s4_conc_ens, s4_conc = cf8_fun.getlipd(
-    'Lindberg.CF8.2024.lpd',
-    paleoData_variableName='split4concentration',
-    depth_name='RPOdepth',
-    val_unit='umol'
-)
-s5_conc_ens, s5_conc = cf8_fun.getlipd(
-    'Lindberg.CF8.2024.lpd',
-    paleoData_variableName='split5concentration',
-    depth_name='RPOdepth',
-    val_unit='umol'
-)
-
-s1_fm_ens, s1_fm = cf8_fun.getlipd(
-    'Lindberg.CF8.2024.lpd',
-    paleoData_variableName='split1fractionModern',
-    depth_name='RPOdepth',
-    val_unit ='unitless'
-)
-s2_fm_ens, s2_fm = cf8_fun.getlipd(
-    'Lindberg.CF8.2024.lpd',
-    paleoData_variableName='split2fractionModern',
-    depth_name='RPOdepth',
-    val_unit ='unitless'
-)
-s3_fm_ens, s3_fm = cf8_fun.getlipd(
-    'Lindberg.CF8.2024.lpd',
-    paleoData_variableName='split3fractionModern',
-    depth_name='RPOdepth',
-    val_unit ='unitless'
-)
-s4_fm_ens, s4_fm = cf8_fun.getlipd(
-    'Lindberg.CF8.2024.lpd',
-    paleoData_variableName='split4fractionModern',
-    depth_name='RPOdepth',
-    val_unit ='unitless'
-)
-s5_fm_ens, s5_fm = cf8_fun.getlipd(
-    'Lindberg.CF8.2024.lpd',
-    paleoData_variableName='split5fractionModern',
-    depth_name='RPOdepth',
-    val_unit ='unitless'
-)
-
-rpo_depth_ens, rpo_depth = cf8_fun.getlipd(
-    'Lindberg.CF8.2024.lpd',
-    paleoData_variableName='RPOdepth',
-    depth_name='RPOdepth',
-    val_unit='cm'
+    [
+        ('split1concentration', 'RPOdepth', 'umol'),
+        ('split2concentration', 'RPOdepth', 'umol'),
+        ('split3concentration', 'RPOdepth', 'umol'),
+        ('split4concentration', 'RPOdepth', 'umol'),
+        ('split5concentration', 'RPOdepth', 'umol'),
+        ('split1fractionModern', 'RPOdepth', 'unitless'),
+        ('split2fractionModern', 'RPOdepth', 'unitless'),
+        ('split3fractionModern', 'RPOdepth', 'unitless'),
+        ('split4fractionModern', 'RPOdepth', 'unitless'),
+        ('split5fractionModern', 'RPOdepth', 'unitless'),
+        ('split1fractionModernUncertainty', 'RPOdepth', 'unitless'),
+        ('split2fractionModernUncertainty', 'RPOdepth', 'unitless'),
+        ('split3fractionModernUncertainty', 'RPOdepth', 'unitless'),
+        ('split4fractionModernUncertainty', 'RPOdepth', 'unitless'),
+        ('split5fractionModernUncertainty', 'RPOdepth', 'unitless'),
+        ('RPOdepth', 'RPOdepth', 'cm')
+    ]
 )
 
 
@@ -129,22 +96,36 @@ fm_df = pd.concat(
         pd.Series(data=s5_fm.paleoData_values, name='s5')
     ], axis=1
 )
+fmunc_df = pd.concat(
+    [
+        pd.Series(data=s1_fmunc.paleoData_values, name='s1'),
+        pd.Series(data=s2_fmunc.paleoData_values, name='s2'),
+        pd.Series(data=s3_fmunc.paleoData_values, name='s3'),
+        pd.Series(data=s4_fmunc.paleoData_values, name='s4'),
+        pd.Series(data=s5_fmunc.paleoData_values, name='s5')
+    ], axis=1
+)
 co2_yield = np.array(co2_df)
 fm_arr = np.array(fm_df)
+fmunc_arr = np.array(fmunc_df)
+
+# RPO CO2 d14C and its uncertainty
+del14c_arr, del14c_unc = cf8_fun.fm_todel14c(fm_arr, yc=2021, sigma=fmunc_arr)
 
 # Convert RPO CO2 split concentrations to inverse cummulative yield
-icy = np.zeros(np.shape(np.array(co2_yield)))
-for i in range(0, np.shape(icy)[0]):
-    for j in range(0, np.shape(icy)[1]):
-        icy[i, j] = 1/(np.sum(co2_yield[i, 0:j+1]))
+icy = cf8_fun.inverse_cumulative_yield(co2_yield)
 
-co2_frac = closure(co2_yield)
-icy_yint = np.zeros(np.shape(icy)[0])
+# Fit RPO CO2 d14C vs. inverse cummulative yield for every depth at once, weighted by
+# the split d14C uncertainties, with 95% CIs of the y-intercepts from Monte Carlo replicates
+icy_slope, icy_yint, icy_yint_qs = cf8_fun.icy_intercepts(
+    icy, del14c_arr, del14c_unc,
+    n_replicates=10000,
+    method='montecarlo',
+    seed=2024
+)
 
 # Calculate RPO CO2 concentration-weighted average Fm
-fm_bulk = np.zeros(np.shape(icy)[0])
-for i in range(0, np.shape(fm_bulk)[0]):
-    fm_bulk[i] = np.sum(co2_frac[i,:]*fm_arr[i,:])/np.sum(co2_frac[i,:])
+fm_bulk = cf8_fun.fm_bulk(co2_yield, fm_arr)
 
 
 # Figure 4 a-b script
@@ -165,15 +146,13 @@ fig, axs = plt.subplots(2,2)
 # Figure 4a: Inverse cummulative yield plot
 ax = axs[0,0]
 for i in range(0, np.shape(icy)[0]):
-    modela = LinearRegression().fit(icy[i,:].reshape((-1,1)), cf8_fun.fm_todel14c(fm_arr[i,:], yc=2021))
-    icy_yint[i] = modela.intercept_
     ax.plot(
-        icy[i,:], (icy[i,:]*modela.coef_+modela.intercept_),
+        icy[i,:], (icy[i,:]*icy_slope[i]+icy_yint[i]),
         linestyle='--', dashes=(3,1), linewidth=1.5, color=fig4_colors[i],
         zorder=1
     )
     ax.scatter(
-        icy[i,:], cf8_fun.fm_todel14c(fm_arr[i,:], yc=2021),
+        icy[i,:], del14c_arr[i,:],
         marker='o', s=40, color=fig4_colors[i], edgecolors='black',
         zorder=2, label=str(rpo_depth.paleoData_values[i])
     )
@@ -190,14 +169,19 @@ ax.legend(loc='center left', bbox_to_anchor=(1,0.5))
 
 # Figure 4b: Inverse cummulative yield y-intercept vs. bulk 14C
 ax = axs[1,0]
-modelb = LinearRegression().fit(cf8_fun.fm_todel14c(fm_bulk, yc=2021).reshape((-1,1)), icy_yint)
-bulk_corr = np.array(scipy.stats.pearsonr(cf8_fun.fm_todel14c(fm_bulk, yc=2021), icy_yint))
+bulk_slope, bulk_yint, bulk_r, bulk_p = cf8_fun.linear_fit(cf8_fun.fm_todel14c(fm_bulk, yc=2021), icy_yint)
 ax.plot(
-    cf8_fun.fm_todel14c(fm_bulk, yc=2021), (cf8_fun.fm_todel14c(fm_bulk, yc=2021)*modelb.coef_+modelb.intercept_),
+    cf8_fun.fm_todel14c(fm_bulk, yc=2021), (cf8_fun.fm_todel14c(fm_bulk, yc=2021)*bulk_slope+bulk_yint),
     linestyle='--', dashes=(3,1), linewidth=1.5, color='black',
     zorder=1
 )
 for j in range(0, np.shape(icy)[0]):
+    ax.errorbar(
+        cf8_fun.fm_todel14c(fm_bulk[j], yc=2021), icy_yint[j],
+        yerr=[[icy_yint[j]-icy_yint_qs[0,j]], [icy_yint_qs[-1,j]-icy_yint[j]]],
+        fmt='none', capsize=3, ecolor=fig4_colors[j], elinewidth=1,
+        zorder=1
+    )
     ax.scatter(
         cf8_fun.fm_todel14c(fm_bulk[j], yc=2021), icy_yint[j],
         marker='o', s=40, color=fig4_colors[j], edgecolors='black',
@@ -217,8 +201,8 @@ axs[1,0].grid(visible=False)
 fig.delaxes(axs[0,1])
 fig.delaxes(axs[1,1])
 
-print("y = " + str(np.round(modelb.coef_, decimals=2)) + "x" + str(np.round(modelb.intercept_, decimals=2)))
-print("R = " + str(np.round(bulk_corr[0], decimals=2)) + "; p = " + str(np.round(bulk_corr[1], decimals=3)))
+print("y = " + str(np.round(bulk_slope, decimals=2)) + "x" + str(np.round(bulk_yint, decimals=2)))
+print("R = " + str(np.round(bulk_r, decimals=2)) + "; p = " + str(np.round(bulk_p, decimals=3)))
 print(
     cf8_fun.del14c_to14c(-200, yc=2021),
     cf8_fun.del14c_to14c(-400, yc=2021),
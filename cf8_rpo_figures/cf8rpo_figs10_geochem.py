@@ -71,10 +71,8 @@ fig, axs = plt.subplots(5,1)
 
 # Figure S10a: Elemental Analyzer % Carbon
 ax = axs[0]
-ea_totalc_ens.common_time(
+ea_totalc_ens.plot_envelope(
     time_axis=ea_totalc.ageMedian,
-    bounds_error=False
-).plot_envelope(
     ax=ax,
     curve_clr='#5e3c99',
     shade_clr='#5e3c99',
@@ -98,10 +96,8 @@ ax.grid(visible=False)
 
 # Figure S10b: Elemental Analyzer Carbon:Nitrogen
 ax = axs[1]
-ea_cn_ens.common_time(
+ea_cn_ens.plot_envelope(
     time_axis=ea_cn.ageMedian,
-    bounds_error=False
-).plot_envelope(
     ax=ax,
     curve_clr='#4dac26',
     shade_clr='#4dac26',
@@ -127,10 +123,8 @@ ax.grid(visible=False)
 
 # Figure S10c: Elemental Analyzer d13C
 ax = axs[2]
-ea_d13c_ens.common_time(
+ea_d13c_ens.plot_envelope(
     time_axis=ea_d13c.ageMedian,
-    bounds_error=False
-).plot_envelope(
     ax=ax,
     curve_clr='#d7191c',
     shade_clr='#d7191c',
@@ -154,10 +148,8 @@ ax.grid(visible=False)
 
 # Figure S10d: ITRAX Magnesium/Iron
 ax = axs[3]
-mnfe_ens.common_time(
+mnfe_ens.plot_envelope(
     time_axis=mnfe.ageMedian,
-    bounds_error=False
-).plot_envelope(
     ax=ax,
     curve_clr='#993404',
     shade_clr='#993404',
@@ -179,10 +171,8 @@ ax.grid(visible=False)
 
 # Figure S10e: Geotek Magnetic Susceptibility
 ax = axs[4]
-ms_ens.common_time(
+ms_ens.plot_envelope(
     time_axis=ms.ageMedian,
-    bounds_error=False
-).plot_envelope(
     ax=ax,
     curve_clr='gray',
     shade_clr='gray',
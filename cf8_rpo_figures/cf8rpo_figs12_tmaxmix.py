@@ -15,8 +15,6 @@
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-from sklearn.linear_model import LinearRegression
-import scipy.stats
 from composition_stats import closure
 import pyleoclim as pyleo
 from pylipd.lipd import LiPD
@@ -57,15 +55,14 @@ tmax_mix = pd.DataFrame(
     }
 ).sort_values(by='tmax')
 
-modelaqua = LinearRegression().fit(
-    np.array(tmax_mix.tmax).reshape((-1,1)), np.array(tmax_mix.mix_aqua)*100
-)
-modelpost = LinearRegression().fit(
-    np.array(tmax_mix.tmax).reshape((-1,1)), np.array(tmax_mix.mix_post)*100
+# Fit MixSIAR aquatic and postglacial % vs. Tmax in one call
+mix_slope, mix_yint, mix_r, mix_p = cf8_fun.linear_fit(
+    np.array(tmax_mix.tmax),
+    np.array(tmax_mix[['mix_aqua','mix_post']]).T*100
 )
 
-aqua_corr = np.array(scipy.stats.pearsonr(tmax_mix.tmax, tmax_mix.mix_aqua))
-post_corr = np.array(scipy.stats.pearsonr(tmax_mix.tmax, tmax_mix.mix_post))
+aqua_corr = np.array([mix_r[0], mix_p[0]])
+post_corr = np.array([mix_r[1], mix_p[1]])
 
 
 # Figure S12 a-b script
@@ -79,7 +76,7 @@ ax.scatter(
     label="R = " + str(np.round(post_corr[0], decimals=3)) + "; p = " + str(np.round(post_corr[1], decimals=2))
 )
 ax.plot(
-    tmax_mix.tmax, (np.array(tmax_mix.tmax)*modelpost.coef_+modelpost.intercept_),
+    tmax_mix.tmax, (np.array(tmax_mix.tmax)*mix_slope[1]+mix_yint[1]),
     linestyle='--', color='black',
     zorder=1
 )
@@ -98,7 +95,7 @@ ax.scatter(
     label="R = " + str(np.round(aqua_corr[0], decimals=3)) + "; p = " + str(np.round(aqua_corr[1], decimals=2))
 )
 ax.plot(
-    tmax_mix.tmax, (np.array(tmax_mix.tmax)*modelaqua.coef_+modelaqua.intercept_),
+    tmax_mix.tmax, (np.array(tmax_mix.tmax)*mix_slope[0]+mix_yint[0]),
     linestyle='--', color='black', zorder=1
 )
 ax.set_xlim([375,450])
@@ -122,8 +119,13 @@ tmax_test = tmax_mix[tmax_mix['tmax'] > 400]
 print(tmax_test)
 print(tmax_mix)
 
-aqua_corr2 = np.array(scipy.stats.pearsonr(tmax_test.tmax, tmax_test.mix_aqua))
-post_corr2 = np.array(scipy.stats.pearsonr(tmax_test.tmax, tmax_test.mix_post))
+mix_slope2, mix_yint2, mix_r2, mix_p2 = cf8_fun.linear_fit(
+    np.array(tmax_test.tmax),
+    np.array(tmax_test[['mix_aqua','mix_post']]).T
+)
+
+aqua_corr2 = np.array([mix_r2[0], mix_p2[0]])
+post_corr2 = np.array([mix_r2[1], mix_p2[1]])
 
 print(post_corr)
 print(post_corr2)
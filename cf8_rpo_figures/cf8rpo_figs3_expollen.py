@@ -37,10 +37,8 @@ cf8_pollen_ens, cf8_pollen = cf8_fun.getlipd(
 # Figure S3 script
 fig, ax = plt.subplots(1,1)
 
-cf8_pollen_ens.common_time(
+cf8_pollen_ens.plot_envelope(
     time_axis=cf8_pollen.ageMedian,
-    bounds_error=False
-).plot_envelope(
     ax=ax,
     curve_clr='#006d2c',
     shade_clr='#006d2c',
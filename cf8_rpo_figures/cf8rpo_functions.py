@@ -11,11 +11,657 @@
 
 
 # See cf8_rpo_conda_env.yml
+import os
+import glob
+import warnings
+import json
 import math
+import hashlib
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
+import matplotlib.pyplot as plt
+from scipy.interpolate import interp1d
+import scipy.stats
 import pyleoclim as pyleo
 from pylipd.lipd import LiPD
+# Radiocarbon conversions (fm_to14c, fm_todel14c, del14c_to14c) live in cf8rpo_radiocarbon
+# and are available here as before
+from cf8rpo_radiocarbon import fm_to14c, fm_todel14c, del14c_to14c
+
+# Define batched linear interpolation of an age ensemble to new depths
+# Gives exactly the same result as calling np.interp(paleoDepth, ensembleDepth, ensembleValues[:,i])
+# for every ensemble member i, but the bracketing ensemble depths and interpolation
+# offsets are found once and applied to blocks of the whole (depth x member) matrix
+# Only the ensemble rows bracketing paleoDepth are read, so memory-mapped
+# ensembles are never loaded in full
+
+# paleoDepth = depths to interpolate to (1D array)
+# ensembleDepth = increasing depths of the ensemble rows (1D array)
+# ensembleValues = (depth x member) ensemble matrix
+# chunk_size = approximate number of matrix elements interpolated per block
+# Returns a (len(paleoDepth) x member) array
+def interp_ensemble(paleoDepth, ensembleDepth, ensembleValues, chunk_size=65536):
+
+    paleoDepth = np.asarray(paleoDepth, dtype=float)
+    ensembleDepth = np.asarray(ensembleDepth, dtype=float)
+    n_depth = len(ensembleDepth)
+
+    if n_depth == 0:
+        raise ValueError('ensembleDepth is empty')
+    if np.shape(ensembleValues)[0] != n_depth:
+        raise ValueError("Ensemble depth and age need to have the same length")
+
+    n_member = np.shape(ensembleValues)[1]
+
+    # Index of the last ensemble depth <= each paleo depth (-1 above the top of the ensemble)
+    j = np.searchsorted(ensembleDepth, paleoDepth, side='right') - 1
+    lo = np.clip(j, 0, n_depth - 1)
+
+    # Depths outside the ensemble, or matching an ensemble depth, take that row as is
+    inner = (j >= 0) & (j < n_depth - 1)
+    inner[inner] = ensembleDepth[j[inner]] != paleoDepth[inner]
+
+    ensembleValuesToPaleo = np.empty((len(paleoDepth), n_member))
+    ensembleValuesToPaleo[~inner] = ensembleValues[lo[~inner]]
+
+    idx = np.flatnonzero(inner)
+    if idx.size > 0:
+        j_in = j[idx]
+        dx = ensembleDepth[j_in + 1] - ensembleDepth[j_in]
+        offset = paleoDepth[idx] - ensembleDepth[j_in]
+        step = max(1, chunk_size // max(n_member, 1))
+
+        # Same arithmetic (and non-finite fallbacks) as np.interp
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for start in range(0, idx.size, step):
+                block = slice(start, start + step)
+                y0 = np.asarray(ensembleValues[j_in[block]], dtype=float)
+                y1 = np.asarray(ensembleValues[j_in[block] + 1], dtype=float)
+
+                slope = y1 - y0
+                slope /= dx[block, None]
+                interp = slope * offset[block, None]
+                interp += y0
+
+                nan_interp = np.isnan(interp)
+                if nan_interp.any():
+                    interp_hi = slope * (paleoDepth[idx[block]] - ensembleDepth[j_in[block] + 1])[:, None]
+                    interp_hi += y1
+                    np.copyto(interp, interp_hi, where=nan_interp)
+                    np.copyto(interp, y0, where=np.isnan(interp) & (y0 == y1))
+
+                ensembleValuesToPaleo[idx[block]] = interp
+
+    # np.interp returns NaN at NaN depths (except for a single-row ensemble)
+    if n_depth > 1:
+        ensembleValuesToPaleo[np.isnan(paleoDepth)] = np.nan
+
+    return ensembleValuesToPaleo
+
+
+# Define function for locating sorted values within each column of a matrix of increasing columns
+# Same as np.searchsorted(xp[:,i], x, side='right') - 1 for every column i, done without a
+# per-column loop: every entry of xp is located once in x, and the number of entries of
+# each column <= x[k] is then a cumulative count over k
+
+# x = increasing values to locate (1D array)
+# xp = (n x m) matrix with increasing columns
+# Returns a (len(x) x m) array of row indices (-1 where x is below the whole column)
+def _searchsorted_columns(x, xp):
+
+    n_col = xp.shape[1]
+
+    # xp[i,c] <= x[k] exactly when k >= pos[i,c]
+    pos = np.searchsorted(x, xp, side='left')
+    counts = np.bincount(
+        (pos * n_col + np.arange(n_col)).ravel(),
+        minlength=(len(x) + 1) * n_col
+    ).reshape(len(x) + 1, n_col)
+
+    return np.cumsum(counts[:-1], axis=0) - 1
+
+
+# Define function for linearly interpolating every ensemble member to a common time axis
+# Same result as pyleoclim common_time(time_axis=time_axis, bounds_error=False), i.e.
+# np.interp of each member's (age, value) pairs, with NaN outside each member's age range,
+# but done for all members at once
+
+# time_axis = increasing times to interpolate to (1D array)
+# ages = (depth x member) age matrix with increasing columns
+# value = paleo data values at each depth, shared by all members (1D array),
+#         or a (depth x member) matrix
+# Returns a (len(time_axis) x member) array
+def _interp_members(time_axis, ages, value):
+
+    time_axis = np.asarray(time_axis, dtype=float)
+    n_depth, n_member = ages.shape
+    members = np.arange(n_member)
+
+    j = _searchsorted_columns(time_axis, ages)
+    lo = np.clip(j, 0, n_depth - 1)
+    hi = np.minimum(lo + 1, n_depth - 1)
+
+    x0 = ages[lo, members]
+    x1 = ages[hi, members]
+    y0 = value[lo] if value.ndim == 1 else value[lo, members]
+    y1 = value[hi] if value.ndim == 1 else value[hi, members]
+    t = time_axis[:, None]
+
+    # Same arithmetic (and non-finite fallbacks) as np.interp
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = (y1 - y0) / (x1 - x0)
+        interp = slope * (t - x0) + y0
+
+        inner = (j >= 0) & (j < n_depth - 1) & (t != x0)
+        nan_interp = inner & np.isnan(interp)
+        if nan_interp.any():
+            np.copyto(interp, slope * (t - x1) + y1, where=nan_interp)
+            np.copyto(interp, y0, where=nan_interp & np.isnan(interp) & (y0 == y1))
+
+    interp = np.where(inner, interp, y0)
+
+    # Times outside a member's age range (bounds_error=False)
+    interp[(j < 0) | (t > ages[-1]) | np.isnan(t)] = np.nan
+
+    return interp
+
+
+# Define function for preparing ensemble members for _interp_members
+# As in pyleoclim, depths with NaN values are dropped, and members are sorted by age
+# (age-depth model members are already increasing, so this is normally a no-op)
+
+# ages = (depth x member) age matrix
+# value = paleo data values at each depth (1D array)
+# Returns (ages, value); value becomes a (depth x member) matrix if members were sorted
+def _prepmembers(ages, value):
+
+    ages = np.asarray(ages, dtype=float)
+    value = np.asarray(value, dtype=float)
+
+    keep = ~np.isnan(value)
+    ages = ages[keep]
+    value = value[keep]
+
+    if np.any(np.diff(ages, axis=0) < 0):
+        order = np.argsort(ages, axis=0, kind='stable')
+        ages = np.take_along_axis(ages, order, axis=0)
+        value = value[order]
+
+    return ages, value
+
+
+# Define function for computing ensemble quantiles on a common time axis
+# Fast replacement for ens.common_time(time_axis=time_axis, bounds_error=False).quantiles(qs):
+# every member is interpolated to the time axis with vectorized interpolation, then
+# np.nanquantile is taken across members. Time points are processed in blocks of
+# about chunk_size interpolated values to bound memory use
+# As in pyleoclim, depths with NaN values are dropped and the time axis is sorted
+
+# ages = (depth x member) age matrix
+# value = paleo data values at each depth (1D array)
+# time_axis = common time axis (1D array)
+# qs = quantiles to compute
+# chunk_size = approximate number of interpolated values held in memory at once
+# Returns (time_axis, ens_qs): the sorted time axis and a (len(qs) x len(time_axis)) array
+def ensemble_quantiles(
+    ages, value, time_axis,
+    qs=(0.025, 0.25, 0.5, 0.75, 0.975),
+    chunk_size=2**22
+):
+
+    time_axis = np.sort(np.asarray(time_axis, dtype=float))
+    ages, value = _prepmembers(ages, value)
+
+    ens_qs = np.empty((len(qs), len(time_axis)))
+    step = max(1, chunk_size // max(ages.shape[1], 1))
+
+    for start in range(0, len(time_axis), step):
+        block = slice(start, start + step)
+        interp = _interp_members(time_axis[block], ages, value)
+
+        # np.quantile is vectorized across rows; np.nanquantile (same result on
+        # rows without NaN) is only needed where some members are out of range
+        has_nan = np.isnan(interp).any(axis=1)
+        block_qs = np.empty((len(qs), interp.shape[0]))
+        block_qs[:, ~has_nan] = np.quantile(interp[~has_nan], qs, axis=1)
+        if has_nan.any():
+            with np.errstate(invalid='ignore'):
+                block_qs[:, has_nan] = np.nanquantile(interp[has_nan], qs, axis=1)
+        ens_qs[:, block] = block_qs
+
+    return time_axis, ens_qs
+
+
+# Define fixed-memory quantile sketch for many points at once
+# Keeps a histogram of equal-width bins spanning [lo, hi] for every point (e.g. every
+# time of an envelope), so ensemble members can be added in chunks and then discarded
+# Quantiles follow np.nanquantile (linear interpolation between order statistics) and
+# every returned quantile is within tol of the exact value, as each order statistic is
+# estimated inside the bin holding it
+# Memory use is n_points x ceil((hi - lo) / tol) counts, whatever the number of members
+
+# n_points = number of points (rows of every update)
+# lo, hi = range of all values that will be added
+# tol = maximum absolute error of the quantiles
+class QuantileSketch:
+
+    def __init__(self, n_points, lo, hi, tol):
+
+        if not np.isfinite(lo) or not np.isfinite(hi) or hi < lo:
+            raise ValueError('lo and hi must be finite with lo <= hi')
+        if not tol > 0:
+            raise ValueError('tol must be positive')
+
+        self.n_points = n_points
+        self.lo = float(lo)
+        self.hi = float(hi)
+        self.tol = float(tol)
+        self.n_bins = max(1, int(math.ceil((self.hi - self.lo) / self.tol)))
+        self.width = (self.hi - self.lo) / self.n_bins
+        self.counts = np.zeros((n_points, self.n_bins), dtype=np.int64)
+
+    def __repr__(self):
+        return f'QuantileSketch(n_points={self.n_points}, n_bins={self.n_bins}, tol={self.tol})'
+
+    # Add a (n_points x k) block of values (NaN values are ignored)
+    def update(self, values):
+
+        values = np.asarray(values, dtype=float).reshape(self.n_points, -1)
+        rows, cols = np.nonzero(~np.isnan(values))
+
+        if self.width > 0:
+            bins = np.floor((values[rows, cols] - self.lo) / self.width)
+            bins = np.clip(bins, 0, self.n_bins - 1).astype(np.int64)
+        else:
+            bins = np.zeros(len(rows), dtype=np.int64)
+
+        self.counts += np.bincount(
+            rows * self.n_bins + bins,
+            minlength=self.counts.size
+        ).reshape(self.counts.shape)
+
+        return self
+
+    # Number of (non-NaN) values added at each point
+    def count(self):
+        return self.counts.sum(axis=1)
+
+    # Estimate the k-th smallest value (0-based) at each point, assuming values are
+    # spread evenly within their bin
+    def _orderstat(self, cum, k):
+
+        b = np.minimum((cum <= k[:, None]).sum(axis=1), self.n_bins - 1)
+        points = np.arange(self.n_points)
+        in_bin = self.counts[points, b]
+        before = cum[points, b] - in_bin
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            frac = (k - before + 0.5) / in_bin
+            return self.lo + self.width * (b + frac)
+
+    # Returns a (len(qs) x n_points) array of quantiles (NaN where no values were added)
+    def quantiles(self, qs=(0.025, 0.25, 0.5, 0.75, 0.975)):
+
+        cum = np.cumsum(self.counts, axis=1)
+        total = cum[:, -1]
+        empty = total == 0
+
+        ens_qs = np.empty((len(qs), self.n_points))
+        with np.errstate(invalid='ignore'):
+            for i, q in enumerate(qs):
+                position = q * (total - 1)
+                k = np.floor(position)
+                gamma = position - k
+                v0 = self._orderstat(cum, k)
+                v1 = self._orderstat(cum, np.minimum(k + 1, total - 1))
+                ens_qs[i] = v0 + gamma * (v1 - v0)
+
+        ens_qs[:, empty] = np.nan
+
+        return ens_qs
+
+
+# Define function for computing ensemble quantiles without holding the age matrix
+# Streaming version of ensemble_quantiles for very large ensembles: members of the
+# (possibly memory-mapped) ensemble table are mapped to paleoDepth, interpolated to the
+# time axis and added to a QuantileSketch member_chunk at a time, so peak memory is set
+# by member_chunk and tol, not by the ensemble size
+
+# paleoDepth = depths of the paleo data (1D array)
+# value = paleo data values at each depth (1D array)
+# ensembleDepth = increasing depths of the ensemble rows (1D array)
+# ensembleValues = (depth x member) ensemble matrix (see getensemble)
+# time_axis = common time axis (1D array)
+# qs = quantiles to compute
+# tol = maximum absolute error of the quantiles (default: 1/1000 of the range of value)
+# member_chunk = number of members processed at once
+# Returns (time_axis, ens_qs): the sorted time axis and a (len(qs) x len(time_axis)) array
+def streaming_quantiles(
+    paleoDepth, value, ensembleDepth, ensembleValues, time_axis,
+    qs=(0.025, 0.25, 0.5, 0.75, 0.975),
+    tol=None,
+    member_chunk=256
+):
+
+    value = np.asarray(value, dtype=float)
+    time_axis = np.sort(np.asarray(time_axis, dtype=float))
+
+    if np.all(np.isnan(value)):
+        return time_axis, np.full((len(qs), len(time_axis)), np.nan)
+
+    # Interpolated values never leave the range of the paleo data
+    lo = np.nanmin(value)
+    hi = np.nanmax(value)
+    if tol is None:
+        tol = (hi - lo) / 1000 if hi > lo else 1.0
+
+    sketch = QuantileSketch(len(time_axis), lo, hi, tol)
+    n_member = np.shape(ensembleValues)[1]
+
+    for start in range(0, n_member, member_chunk):
+        ages = interp_ensemble(
+            paleoDepth, ensembleDepth,
+            ensembleValues[:, start:start + member_chunk]
+        )
+        ages, member_value = _prepmembers(ages, value)
+        sketch.update(_interp_members(time_axis, ages, member_value))
+
+    return time_axis, sketch.quantiles(qs)
+
+
+# Define function for regridding a range of ensemble members with scipy interp1d
+# Same steps as pyleoclim.utils.tsutils.interp for every member: NaN values are dropped,
+# the member is sorted by age and interpolated to time_axis
+# Results are written to out[:, start:stop]
+
+# ages = (depth x member) age matrix
+# value = paleo data values at each depth (1D array), or a (depth x member) matrix
+# time_axis = sorted time axis (1D array)
+# out = (len(time_axis) x member) output array
+# start, stop = range of members to regrid
+# interp_kwargs = keyword arguments of scipy.interpolate.interp1d (e.g. kind, bounds_error)
+def _regrid_members(ages, value, time_axis, out, start, stop, interp_kwargs):
+
+    for i in range(start, stop):
+        x = ages[:, i]
+        y = value if value.ndim == 1 else value[:, i]
+
+        keep = ~np.isnan(y)
+        x = x[keep]
+        y = y[keep]
+
+        order = np.argsort(x, kind='stable')
+        out[:, i] = interp1d(x[order], y[order], **interp_kwargs)(time_axis)
+
+
+# Shared-memory arrays of the current regrid_ensemble call, attached once per worker
+_regrid_shared = {}
+
+
+# Define function for attaching a worker process to the shared-memory arrays
+# arrays = {name: (shared memory block name, shape)} of float64 arrays
+def _regrid_attach(arrays):
+
+    for key, (shm_name, shape) in arrays.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        _regrid_shared[key] = (shm, np.ndarray(shape, dtype=float, buffer=shm.buf))
+
+
+# Define worker task of regrid_ensemble: regrid members start:stop in shared memory
+def _regrid_task(start, stop, interp_kwargs):
+
+    _regrid_members(
+        _regrid_shared['ages'][1], _regrid_shared['value'][1], _regrid_shared['time_axis'][1],
+        _regrid_shared['out'][1], start, stop, interp_kwargs
+    )
+
+
+# Define function for regridding every ensemble member to a common time axis
+# Equivalent of ens.common_time(time_axis=time_axis, **interp_kwargs) for any interp1d kind
+# (e.g. 'nearest', 'cubic'); for linear envelopes ensemble_quantiles is much faster
+# With workers > 1, members are split across a process pool; the age matrix, values and
+# output live in shared memory so no worker receives a pickled copy, and every member is
+# computed by the same code as the serial path, so results are identical
+
+# ages = (depth x member) age matrix
+# value = paleo data values at each depth (1D array), or a (depth x member) matrix
+# time_axis = common time axis (1D array)
+# workers = number of worker processes (1 runs serially in this process)
+# interp_kwargs = keyword arguments of scipy.interpolate.interp1d (e.g. kind, bounds_error)
+# Returns (time_axis, regridded): the sorted time axis and a (len(time_axis) x member) array
+def regrid_ensemble(ages, value, time_axis, workers=1, **interp_kwargs):
+
+    ages = np.asarray(ages, dtype=float)
+    value = np.asarray(value, dtype=float)
+    time_axis = np.sort(np.asarray(time_axis, dtype=float))
+
+    if ages.ndim != 2:
+        raise ValueError('ages must be a (depth x member) matrix')
+    if ages.shape[0] != len(value):
+        raise ValueError("Paleo depth and age need to have the same length")
+
+    n_member = ages.shape[1]
+    regridded = np.empty((len(time_axis), n_member))
+
+    if workers <= 1 or n_member < 2:
+        _regrid_members(ages, value, time_axis, regridded, 0, n_member, interp_kwargs)
+        return time_axis, regridded
+
+    # Copy the inputs into shared memory once; workers attach to them by name
+    blocks = []
+    arrays = {}
+    try:
+        for key, arr in (('ages', ages), ('value', value), ('time_axis', time_axis), ('out', regridded)):
+            shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+            blocks.append(shm)
+            np.ndarray(arr.shape, dtype=float, buffer=shm.buf)[...] = arr
+            arrays[key] = (shm.name, arr.shape)
+
+        # fork keeps the figure scripts (which have no __main__ guard) from being re-run
+        # by every worker; other platforms fall back to their default start method
+        if 'fork' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('fork')
+        else:
+            context = multiprocessing.get_context()
+
+        bounds = np.linspace(0, n_member, min(n_member, 4*workers) + 1).astype(int)
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=context,
+            initializer=_regrid_attach, initargs=(arrays,)
+        ) as pool:
+            tasks = [
+                pool.submit(_regrid_task, start, stop, interp_kwargs)
+                for start, stop in zip(bounds[:-1], bounds[1:])
+            ]
+            for task in tasks:
+                task.result()
+
+        regridded[...] = np.ndarray(regridded.shape, dtype=float, buffer=blocks[-1].buf)
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+    return time_axis, regridded
+
+
+# Define function for building a pyleoclim-style axis label, e.g. 'Time [age yr BP]'
+def _axislabel(name, unit):
+
+    if name is None:
+        return None
+    if unit is None:
+        return name
+
+    return f'{name} [{unit}]'
+
+
+# Define compact age ensemble of one paleo variable
+# Holds a single (depth x member) age matrix and one copy of the paleo values
+# shared by every member, instead of one pyleoclim.Series per member
+# The equivalent pyleoclim.EnsembleSeries is only built when a pyleoclim method
+# or attribute is first used (e.g. ens.common_time(...), ens.series_list)
+
+# ages = (depth x member) age matrix
+# value = paleo data values at each depth (1D array)
+# value_name, value_unit, time_name, time_unit = pyleoclim.Series labels
+class AgeEnsemble:
+
+    def __init__(
+        self, ages, value,
+        value_name=None, value_unit=None, time_name=None, time_unit=None
+    ):
+
+        ages = np.asarray(ages)
+        value = np.asarray(value)
+
+        if ages.ndim != 2:
+            raise ValueError('ages must be a (depth x member) matrix')
+        if ages.shape[0] != len(value):
+            raise ValueError("Paleo depth and age need to have the same length")
+
+        self.ages = ages
+        self.value = value
+        self.value_name = value_name
+        self.value_unit = value_unit
+        self.time_name = time_name
+        self.time_unit = time_unit
+        self._ensemble_series = None
+
+    def __len__(self):
+        return self.ages.shape[1]
+
+    def __repr__(self):
+        return f'AgeEnsemble(value_name={self.value_name!r}, depths={self.ages.shape[0]}, members={self.ages.shape[1]})'
+
+    # Build (once) the equivalent pyleoclim.EnsembleSeries
+    def to_pyleo(self):
+
+        if self._ensemble_series is None:
+            series_list = []
+
+            for s in self.ages.T:
+                series_tmp = pyleo.Series(
+                    time=s, value=self.value,
+                    verbose=False,
+                    clean_ts=False,
+                    value_name=self.value_name,
+                    value_unit=self.value_unit,
+                    time_name=self.time_name,
+                    time_unit=self.time_unit
+                )
+                series_list.append(series_tmp)
+
+            self._ensemble_series = pyleo.EnsembleSeries(series_list=series_list)
+
+        return self._ensemble_series
+
+    # Same as pyleoclim EnsembleSeries.common_time, but interpolation to a given time_axis
+    # is done by regrid_ensemble, optionally on several worker processes
+    # (interp_type and any interp1d arguments are passed on as in pyleoclim)
+    def common_time(self, method='interp', time_axis=None, workers=1, **kwargs):
+
+        if method != 'interp' or time_axis is None:
+            return self.to_pyleo().common_time(method=method, time_axis=time_axis, **kwargs)
+
+        kwargs = dict(kwargs)
+        kwargs['kind'] = kwargs.pop('interp_type', 'linear')
+        time, regridded = regrid_ensemble(
+            self.ages, self.value, time_axis, workers=workers, **kwargs
+        )
+
+        series_list = []
+        for s in regridded.T:
+            series_tmp = pyleo.Series(
+                time=time, value=s,
+                verbose=False,
+                clean_ts=False,
+                value_name=self.value_name,
+                value_unit=self.value_unit,
+                time_name=self.time_name,
+                time_unit=self.time_unit
+            )
+            series_list.append(series_tmp)
+
+        return pyleo.EnsembleSeries(series_list=series_list)
+
+    # Compute ensemble quantiles on a common time axis (see ensemble_quantiles)
+    def envelope(self, time_axis, qs=(0.025, 0.25, 0.5, 0.75, 0.975)):
+
+        return ensemble_quantiles(self.ages, self.value, time_axis, qs=qs)
+
+    # Plot the ensemble as a quantile envelope on a common time axis
+    # Fast equivalent of ens.common_time(time_axis=time_axis, bounds_error=False).plot_envelope(...)
+    # with the same arguments and styling as pyleoclim's EnsembleSeries.plot_envelope
+    def plot_envelope(
+        self, time_axis, ax=None, figsize=[10, 4], qs=[0.025, 0.25, 0.5, 0.75, 0.975],
+        xlabel=None, ylabel=None, title=None, xlim=None, ylim=None, plot_legend=True,
+        curve_clr='#d9544f', curve_lw=2, shade_clr='#d9544f', shade_alpha=0.2,
+        inner_shade_label='IQR', outer_shade_label='95% CI', lgd_kwargs=None
+    ):
+
+        lgd_kwargs = {} if lgd_kwargs is None else lgd_kwargs.copy()
+
+        if xlabel is None:
+            xlabel = _axislabel(self.time_name, self.time_unit)
+        if ylabel is None:
+            ylabel = _axislabel(self.value_name, self.value_unit)
+
+        if ax is None:
+            fig, ax = plt.subplots(figsize=figsize)
+
+        time, ens_qs = self.envelope(time_axis, qs=qs)
+
+        # plot outer envelope
+        ax.fill_between(
+            time, ens_qs[0], ens_qs[-1],
+            color=shade_clr, alpha=shade_alpha, edgecolor=shade_clr, label=outer_shade_label
+        )
+        # plot inner envelope on top
+        ax.fill_between(
+            time, ens_qs[1], ens_qs[-2],
+            color=shade_clr, alpha=2*shade_alpha, edgecolor=shade_clr, label=inner_shade_label
+        )
+        # plot the median
+        ax.plot(
+            time, ens_qs[len(qs)//2],
+            linewidth=curve_lw, color=curve_clr, zorder=100, label='median'
+        )
+
+        if xlabel is not None:
+            ax.set_xlabel(xlabel)
+        if ylabel is not None:
+            ax.set_ylabel(ylabel)
+        if xlim is not None:
+            ax.set_xlim(xlim)
+        if ylim is not None:
+            ax.set_ylim(ylim)
+        if title is not None:
+            ax.set_title(title)
+
+        if plot_legend:
+            lgd_args = {'frameon': False}
+            lgd_args.update(lgd_kwargs)
+            ax.legend(**lgd_args)
+        else:
+            ax.legend().set_visible(False)
+
+        if 'fig' in locals():
+            return fig, ax
+        else:
+            return ax
+
+    # Anything not defined here is looked up on the pyleoclim.EnsembleSeries
+    def __getattr__(self, name):
+
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        return getattr(self.to_pyleo(), name)
+
 
 # Create age ensemble mapping function for associated LiPD files
 # Function from PyleoTutorials: Working with Age Ensembles
@@ -61,8 +707,9 @@ def mapAgeEnsembleToPaleoData(
     Returns
     -------
 
-    ensemble : pyleoclim.EnsembleSeries
+    ensemble : AgeEnsemble
         A matrix of age ensemble on the PaleoData scale
+        (converts to pyleoclim.EnsembleSeries on demand)
 
     """
 
@@ -85,81 +732,312 @@ def mapAgeEnsembleToPaleoData(
     if len(paleoValues) != len(paleoDepth):
         raise ValueError("Paleo depth and age need to have the same length")
 
-    # Interpolate
-    ensembleValuesToPaleo = np.zeros((len(paleoDepth),np.shape(ensembleValues)[1])) #placeholder
+    # Interpolate (all ensemble members at once, see interp_ensemble)
+    ensembleValuesToPaleo = interp_ensemble(paleoDepth, ensembleDepth, ensembleValues)
+
+    ensemble = AgeEnsemble(
+        ages=ensembleValuesToPaleo, value=paleoValues,
+        value_name=value_name,
+        value_unit=value_unit,
+        time_name=time_name,
+        time_unit=time_unit
+    )
+
+    return ensemble
 
-    for i in np.arange(0,np.shape(ensembleValues)[1]):
-        ensembleValuesToPaleo[:,i]=np.interp(paleoDepth,ensembleDepth,ensembleValues[:,i])
 
-    series_list = []
+# Process-wide cache of parsed LiPD files
+# Keyed by absolute file path so each file is only parsed once per session
+_lipd_cache = {}
 
-    for s in ensembleValuesToPaleo.T:
-        series_tmp = pyleo.Series(
-            time=s, value=paleoValues,
-            verbose=False,
-            clean_ts=False,
-            value_name=value_name,
-            value_unit=value_unit,
-            time_name=time_name,
-            time_unit=time_unit
-        )
-        series_list.append(series_tmp)
+# Folder (created next to each LiPD file) holding the on-disk parsed LiPD caches
+LIPD_CACHE_DIR = '.cf8rpo_cache'
 
-    ensemble = pyleo.EnsembleSeries(series_list=series_list)
+# On-disk cache layout version (bump when the cache layout changes)
+_LIPD_CACHE_VERSION = 2
 
-    return ensemble
 
+# Define function for hashing the contents of a LiPD file
+def _lipdhash(filename):
 
-# Define function for importing LiPD data
+    file_hash = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            file_hash.update(chunk)
+
+    return file_hash.hexdigest()
+
+
+# Define function for locating the on-disk cache files of a LiPD file
+# file_hash = content hash of the LiPD file (None matches caches of any hash)
+# suffix = '.npz' for the dataframe cache, '.ens<ens_num>.npy' for an ensemble table
+#          ('.*' matches every cache file)
+def _lipdcachepath(filename, file_hash=None, suffix='.npz'):
+
+    folder = os.path.join(os.path.dirname(os.path.abspath(filename)), LIPD_CACHE_DIR)
+    tag = '*' if file_hash is None else f'{file_hash[:16]}.v{_LIPD_CACHE_VERSION}'
+
+    return os.path.join(folder, f'{os.path.basename(filename)}.{tag}{suffix}')
+
+
+# Define function for saving an array to a .npy file
+# Writes to a temporary file first so an interrupted run never leaves a partial file
+def _savenpy(path, arr):
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, arr)
+    os.replace(tmp_path, path)
+
+
+# Define functions for converting a dataframe to/from .npz arrays
+# Numeric list/array cells are stored as binary arrays ('<prefix>/<row>/<col>'),
+# every other cell is stored as JSON in '<prefix>/meta'
+def _frametonpz(df, prefix, arrays):
+
+    cells = []
+    for row in df.itertuples(index=False):
+        row_cells = []
+        for value in row:
+            if isinstance(value, (list, tuple, np.ndarray)):
+                arr = np.asarray(value)
+                if arr.dtype.kind in 'biuf':
+                    arrays[f'{prefix}/{len(cells)}/{len(row_cells)}'] = arr
+                    row_cells.append({'a': 'ndarray' if isinstance(value, np.ndarray) else 'list'})
+                    continue
+            if isinstance(value, np.generic):
+                value = value.item()
+            row_cells.append({'v': value})
+        cells.append(row_cells)
+
+    arrays[f'{prefix}/meta'] = np.array(
+        json.dumps({'columns': list(df.columns), 'index': list(df.index), 'cells': cells}, default=str)
+    )
+
+
+def _framefromnpz(npz, prefix):
+
+    meta = json.loads(str(npz[f'{prefix}/meta']))
+
+    rows = []
+    for i, row_cells in enumerate(meta['cells']):
+        row = []
+        for j, cell in enumerate(row_cells):
+            if 'a' in cell:
+                arr = npz[f'{prefix}/{i}/{j}']
+                row.append(arr if cell['a'] == 'ndarray' else arr.tolist())
+            else:
+                row.append(cell['v'])
+        rows.append(row)
+
+    return pd.DataFrame(rows, columns=meta['columns'], index=meta['index'])
+
+
+# Define function for writing the on-disk cache of a LiPD file
+# Each age ensemble matrix (ensembleVariableValues) is written once to its own
+# .npy file so it can be memory-mapped; the rest goes into a single .npz file
+# Older caches of the same file (different content hash) are removed
+def _writelipdcache(filename, file_hash, ensemble_df, df):
+
+    cache_path = _lipdcachepath(filename, file_hash)
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+
+    for old_path in glob.glob(_lipdcachepath(filename, suffix='.*')):
+        os.remove(old_path)
+
+    ensemble_df = ensemble_df.copy()
+    ensemble_files = []
+    for ens_num, ensembleValues in enumerate(ensemble_df['ensembleVariableValues']):
+        ens_path = _lipdcachepath(filename, file_hash, f'.ens{ens_num}.npy')
+        _savenpy(ens_path, np.asarray(ensembleValues, dtype=float))
+        ensemble_files.append(os.path.basename(ens_path))
+    ensemble_df['ensembleVariableValues'] = ensemble_files
+
+    arrays = {}
+    _frametonpz(ensemble_df, 'ensemble', arrays)
+    _frametonpz(df, 'timeseries', arrays)
+
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, cache_path)
+
+
+# Define function for reading the on-disk cache of a LiPD file
+# Age ensemble matrices are opened read-only with np.load(mmap_mode='r'), so
+# they are paged in from disk as needed rather than held in memory
+# Returns (ensemble_df, timeseries_df), or None if no cache matches file_hash
+def _readlipdcache(filename, file_hash):
+
+    cache_path = _lipdcachepath(filename, file_hash)
+    if not os.path.exists(cache_path):
+        return None
+
+    with np.load(cache_path) as npz:
+        ensemble_df = _framefromnpz(npz, 'ensemble')
+        df = _framefromnpz(npz, 'timeseries')
+
+    folder = os.path.dirname(cache_path)
+    ensemble_df['ensembleVariableValues'] = pd.Series(
+        [np.load(os.path.join(folder, ens_file), mmap_mode='r') for ens_file in ensemble_df['ensembleVariableValues']],
+        index=ensemble_df.index,
+        dtype=object
+    )
+
+    return ensemble_df, df
+
+
+# Define function for loading (and caching) a parsed LiPD file
+# Returns a dict holding the LiPD dataset object ('dataset'), the ensemble
+# table dataframe ('ensemble_df'), the timeseries dataframe ('timeseries_df'),
+# the file content hash ('hash'), and the memoized depth-mapped ages ('ages', see _lipdages)
+# The ensemble and timeseries dataframes are also written to a .npz cache in
+# LIPD_CACHE_DIR, keyed by the file content hash, so later sessions skip parsing
+# the LiPD file until it changes. 'dataset' is None when the dataframes were read
+# from the on-disk cache (see lipd_dataset). With the on-disk cache, age ensemble
+# matrices in 'ensemble_df' are read-only memory-mapped arrays (see getensemble)
 
 # filename = name of LiPD file
-# paleoData_variableName = column name of variable being imported
-# depth_name = column name of depth variable (for using depths in multiple paleoData tables)
-# val_unit = unit of the variable being imported
-# ens_num = index of paleo data table containing the imported variable
-def getlipd(
-    filename,
+# disk_cache = read/write the on-disk cache
+def loadlipd(filename, disk_cache=True):
+
+    key = os.path.abspath(filename)
+
+    if key not in _lipd_cache:
+        file_hash = _lipdhash(filename)
+        cached = _readlipdcache(filename, file_hash) if disk_cache else None
+
+        if cached is not None:
+            D = None
+            ensemble_df, df = cached
+        else:
+            D = LiPD()
+            D.load(filename)
+
+            ensemble_df = D.get_ensemble_tables()
+            timeseries, df = D.get_timeseries(D.get_all_dataset_names(), to_dataframe=True)
+
+            if disk_cache:
+                _writelipdcache(filename, file_hash, ensemble_df, df)
+                ensemble_df, df = _readlipdcache(filename, file_hash)
+
+        _lipd_cache[key] = {
+            'dataset': D,
+            'ensemble_df': ensemble_df,
+            'timeseries_df': df,
+            'hash': file_hash,
+            'ages': {}
+        }
+
+    return _lipd_cache[key]
+
+
+# Define function for getting the parsed LiPD dataset object of a cached file
+# Parses the LiPD file if its dataframes were read from the on-disk cache
+
+# filename = name of LiPD file
+def lipd_dataset(filename):
+
+    lipd = loadlipd(filename)
+
+    if lipd['dataset'] is None:
+        D = LiPD()
+        D.load(filename)
+        lipd['dataset'] = D
+
+    return lipd['dataset']
+
+
+# Define function for getting an age ensemble table of a LiPD file
+# Returns (ensembleDepth, ensembleValues); with the on-disk cache, ensembleValues
+# is a read-only memory-mapped (depth x member) array
+
+# filename = name of LiPD file
+# ens_num = index of the ensemble table
+def getensemble(filename, ens_num=0):
+
+    ensemble_table = loadlipd(filename)['ensemble_df'].iloc[ens_num]
+
+    return np.asarray(ensemble_table['ensembleDepthValues'], dtype=float), ensemble_table['ensembleVariableValues']
+
+
+# Define function for invalidating cached LiPD files
+# Call after a LiPD file is edited on disk during a session
+
+# filename = name of LiPD file to drop from the cache (None clears all files loaded this session)
+# disk = also delete the on-disk cache of the file(s)
+def clear_lipd_cache(filename=None, disk=False):
+
+    if filename is None:
+        keys = list(_lipd_cache)
+    else:
+        keys = [os.path.abspath(filename)]
+
+    for key in keys:
+        _lipd_cache.pop(key, None)
+        if disk:
+            for cache_path in glob.glob(_lipdcachepath(key, suffix='.*')):
+                os.remove(cache_path)
+
+
+# Define function for mapping an ensemble table to a depth axis, memoized per LiPD file
+# Variables sharing a depth axis (e.g. every RPOdepth variable) share one read-only
+# (depth x member) age matrix, so each distinct depth axis is interpolated once
+
+# lipd = cached LiPD file (see loadlipd)
+# ens_num = index of the ensemble table
+# paleoDepth = depths to map the ensemble to (1D array)
+def _lipdages(lipd, ens_num, paleoDepth):
+
+    paleoDepth = np.asarray(paleoDepth, dtype=float)
+    key = (ens_num, paleoDepth.tobytes())
+
+    if key not in lipd['ages']:
+        ensemble_table = lipd['ensemble_df'].iloc[ens_num]
+        ages = interp_ensemble(
+            paleoDepth,
+            np.squeeze(np.array(ensemble_table['ensembleDepthValues'])),
+            ensemble_table['ensembleVariableValues']
+        )
+        ages.flags.writeable = False
+        lipd['ages'][key] = ages
+
+    return lipd['ages'][key]
+
+
+# Define function for building the age ensemble and age axis of one LiPD variable
+# Shared by getlipd and getlipd_many
+
+# lipd = cached LiPD file (see loadlipd)
+# df_row = timeseries dataframe row of the variable being imported
+# paleoData_variableName, depth_name, val_unit, ens_num = see getlipd
+def _lipdvariable(
+    lipd,
+        df_row,
         paleoData_variableName,
         depth_name,
         val_unit,
-        ens_num=0
+        ens_num
 ):
 
-    D = LiPD()
-    D.load(filename)
-
-    ensemble_df = D.get_ensemble_tables()
-    pd.set_option('display.max_columns', None)
-    # print(ensemble_df)
-
-    timeseries, df = D.get_timeseries(D.get_all_dataset_names(), to_dataframe=True)
-    # print(df)
-    # print(df.columns)
-    df['paleoData_variableName'].unique()
+    ensemble_df = lipd['ensemble_df']
 
-    df_row = df.loc[df['paleoData_variableName']==paleoData_variableName]
     paleoDepth = np.array(*df_row[depth_name])
     paleoAgeMedian = np.array(*df_row['ageMedian'])
     paleoValues = np.array(*df_row['paleoData_values'])
     # paleo_depth_units = df_row['depthUnits']
     value_name = paleoData_variableName
     value_unit = val_unit
-    ensembleDepth = ensemble_df.iloc[ens_num]['ensembleDepthValues']
-    ensembleValues = ensemble_df.iloc[ens_num]['ensembleVariableValues']
     ensemble_depth_units = ensemble_df.iloc[ens_num]['ensembleDepthUnits']
     time_name = 'Time'
     time_unit = f'{ensemble_df.iloc[ens_num]["ensembleVariableName"]} {ensemble_df.iloc[ens_num]["ensembleVariableUnits"]}'
-    # print(type(ensembleValues))
-    # print(ensembleValues)
-    # print(ensembleDepth)
-    # print(paleoValues)
-    # print(f'Num rows in ensembleValues: {ensembleValues.shape[0]}, Length of ensembleDepth: {len(ensembleDepth)}')
-
-    ensemble = mapAgeEnsembleToPaleoData(
-        ensembleValues=ensembleValues,
-        paleoValues=paleoValues,
-        ensembleDepth=ensembleDepth,
-        paleoDepth=paleoDepth,
+
+    if len(paleoValues) != len(paleoDepth):
+        raise ValueError("Paleo depth and age need to have the same length")
+
+    ensemble = AgeEnsemble(
+        ages=_lipdages(lipd, ens_num, paleoDepth),
+        value=paleoValues,
         value_name=value_name,
         value_unit=value_unit,
         time_name=time_name,
@@ -177,28 +1055,607 @@ def getlipd(
     return ensemble, age_axis
 
 
-# Convert fraction modern values to uncalibrated 14C yrs
-def fm_to14c(fm):
-    fm_arr = np.array(fm)
-    to14c = -8033*np.log(fm_arr)
+# Define function for importing LiPD data
+
+# filename = name of LiPD file
+# paleoData_variableName = column name of variable being imported
+# depth_name = column name of depth variable (for using depths in multiple paleoData tables)
+# val_unit = unit of the variable being imported
+# ens_num = index of paleo data table containing the imported variable
+def getlipd(
+    filename,
+        paleoData_variableName,
+        depth_name,
+        val_unit,
+        ens_num=0
+):
+
+    lipd = loadlipd(filename)
+
+    ensemble_df = lipd['ensemble_df']
+    pd.set_option('display.max_columns', None)
+    # print(ensemble_df)
+
+    df = lipd['timeseries_df']
+    # print(df)
+    # print(df.columns)
+
+    df_row = df.loc[df['paleoData_variableName']==paleoData_variableName]
+
+    return _lipdvariable(
+        lipd, df_row,
+        paleoData_variableName, depth_name, val_unit, ens_num
+    )
+
+
+# Define function for importing many variables from the same LiPD file
+# Returns a list of (ensemble, age_axis) tuples in the same order as specs
+
+# filename = name of LiPD file
+# specs = list of (paleoData_variableName, depth_name, val_unit) or
+#         (paleoData_variableName, depth_name, val_unit, ens_num) tuples (see getlipd)
+def getlipd_many(filename, specs):
+
+    lipd = loadlipd(filename)
+
+    df = lipd['timeseries_df']
+    variable_names = df['paleoData_variableName'].to_numpy()
+
+    imported = []
+    for spec in specs:
+        if len(spec) == 3:
+            paleoData_variableName, depth_name, val_unit = spec
+            ens_num = 0
+        elif len(spec) == 4:
+            paleoData_variableName, depth_name, val_unit, ens_num = spec
+        else:
+            raise ValueError(
+                "specs entries must be (paleoData_variableName, depth_name, val_unit[, ens_num])"
+            )
+
+        df_row = df.loc[variable_names==paleoData_variableName]
+        imported.append(
+            _lipdvariable(
+                lipd, df_row,
+                paleoData_variableName, depth_name, val_unit, ens_num
+            )
+        )
+
+    return imported
+
+
+# Define function for computing the ensemble quantiles of one LiPD variable by streaming
+# the ensemble table (see streaming_quantiles); the (depth x member) age matrix of the
+# variable is never built
+
+# filename, paleoData_variableName, depth_name, ens_num = see getlipd
+# time_axis = common time axis (default: median ages of the variable)
+# qs, tol, member_chunk = see streaming_quantiles
+# Returns (time_axis, ens_qs)
+def getlipd_quantiles(
+    filename,
+        paleoData_variableName,
+        depth_name,
+        time_axis=None,
+        qs=(0.025, 0.25, 0.5, 0.75, 0.975),
+        tol=None,
+        ens_num=0,
+        member_chunk=256
+):
+
+    df = loadlipd(filename)['timeseries_df']
+    df_row = df.loc[df['paleoData_variableName']==paleoData_variableName]
+
+    paleoDepth = np.array(*df_row[depth_name], dtype=float)
+    paleoValues = np.array(*df_row['paleoData_values'], dtype=float)
+
+    if len(paleoValues) != len(paleoDepth):
+        raise ValueError("Paleo depth and age need to have the same length")
+
+    if time_axis is None:
+        time_axis = np.array(*df_row['ageMedian'], dtype=float)
+
+    ensembleDepth, ensembleValues = getensemble(filename, ens_num)
+
+    return streaming_quantiles(
+        paleoDepth, paleoValues, ensembleDepth, ensembleValues, time_axis,
+        qs=qs, tol=tol, member_chunk=member_chunk
+    )
+
+
+# Define function for computing accumulation rates of every age ensemble member
+# Rates are taken on the full ensemble table (1 / (d age / d depth)) and then mapped to
+# paleoDepth, for drawing accumulation together with ages in oc_accumulation_mc
+
+# paleoDepth = depths to map the rates to (1D array)
+# ensembleDepth = increasing depths of the ensemble rows (1D array)
+# ensembleValues = (depth x member) ensemble matrix (see getensemble)
+# Returns a (len(paleoDepth) x member) array in depth units per age unit (e.g. cm/yr)
+def ensemble_accumulation(paleoDepth, ensembleDepth, ensembleValues):
+
+    ensembleDepth = np.asarray(ensembleDepth, dtype=float)
+
+    with np.errstate(divide='ignore'):
+        rates = 1/np.gradient(np.asarray(ensembleValues, dtype=float), ensembleDepth, axis=0)
+
+    return interp_ensemble(paleoDepth, ensembleDepth, rates)
+
+
+# Define function for drawing one chunk of Monte Carlo OC mass accumulation rates
+# Returns a (k x (1 + source) x depth) array: total rate, then the rate of each source
+def _oc_draws(rng, k, dbd, dbd_sd, toc, toc_sd, acc, fractions, fractions_sd):
+
+    n_depth = len(dbd)
+
+    dbd_draw = np.maximum(rng.normal(dbd, dbd_sd, size=(k, n_depth)), 0)
+
+    if toc_sd is None:
+        toc_draw = toc
+    else:
+        toc_draw = np.maximum(rng.normal(toc, toc_sd, size=(k, n_depth)), 0)
+
+    # Accumulation rates of randomly drawn age ensemble members
+    if acc.ndim == 1:
+        acc_draw = acc
+    else:
+        acc_draw = acc[:, rng.integers(acc.shape[1], size=k)].T
+
+    fraction_draw = np.clip(
+        rng.normal(fractions, fractions_sd, size=(k,) + fractions.shape), 0, 1
+    )
+
+    draws = np.empty((k, 1 + fractions.shape[0], n_depth))
+    draws[:, 0] = dbd_draw*(toc_draw*0.01)*acc_draw*(1e4)
+    draws[:, 1:] = draws[:, :1]*fraction_draw
+
+    return draws
+
+
+# Define Monte Carlo engine for OC mass accumulation rates of each mixing model source
+# Replaces mean / mean +- stdev bands: every input is drawn for each Monte Carlo draw,
+# dry bulk density (and TOC if toc_sd is given) from normal distributions truncated at 0,
+# MixSIAR fractions from normal distributions clipped to [0, 1] (the LiPD file holds
+# their means and stdevs only, not the posterior correlations between sources), and
+# accumulation rates optionally from age ensemble members
+# Draws are made chunk_size at a time, each chunk with its own seed, and reduced to
+# quantiles with a QuantileSketch, so memory use does not grow with n_draws
+# (the first pass over the chunks finds the range of every rate at every depth, the
+# second bins each rate on its own range, so rates that do not vary, e.g. a source with
+# fraction 0 and stdev 0, get exact quantiles)
+# Rates are in g OC/m2/yr
+
+# dbd, dbd_sd = dry bulk density and its stdev (g/cm3) at each depth
+# toc = total organic carbon (%) at each depth
+# acc = accumulation rate (cm/yr) at each depth, or a (depth x member) matrix of age
+#       ensemble accumulation rates (see ensemble_accumulation)
+# fractions, fractions_sd = (source x depth) MixSIAR fractions and their stdevs
+# toc_sd = stdev of toc (None keeps toc fixed)
+# n_draws = number of Monte Carlo draws
+# qs = quantiles to compute
+# seed = random seed (results are reproducible for a given seed and chunk_size)
+# chunk_size = number of draws held in memory at once
+# tol = maximum error of the quantiles as a fraction of the range of each rate at each depth
+# return_draws = also return every draw as a (n_draws x (1 + source) x depth) array
+# Returns (total_qs, source_qs[, draws]): a (len(qs) x depth) array of total OC
+# accumulation rate quantiles and a (source x len(qs) x depth) array for each source
+def oc_accumulation_mc(
+    dbd, dbd_sd, toc, acc, fractions, fractions_sd,
+    toc_sd=None,
+    n_draws=100000,
+    qs=(0.025, 0.5, 0.975),
+    seed=0,
+    chunk_size=10000,
+    tol=1e-4,
+    return_draws=False
+):
+
+    dbd = np.asarray(dbd, dtype=float)
+    dbd_sd = np.nan_to_num(np.asarray(dbd_sd, dtype=float))
+    toc = np.asarray(toc, dtype=float)
+    if toc_sd is not None:
+        toc_sd = np.nan_to_num(np.asarray(toc_sd, dtype=float))
+    acc = np.asarray(acc, dtype=float)
+    fractions = np.atleast_2d(np.asarray(fractions, dtype=float))
+    fractions_sd = np.nan_to_num(np.atleast_2d(np.asarray(fractions_sd, dtype=float)))
+
+    n_source, n_depth = fractions.shape
+    if not (len(dbd) == len(toc) == len(acc) == n_depth):
+        raise ValueError('All inputs need to have the same number of depths')
+
+    inputs = (dbd, dbd_sd, toc, toc_sd, acc, fractions, fractions_sd)
+    chunk_sizes = [min(chunk_size, n_draws - start) for start in range(0, n_draws, chunk_size)]
+    chunk_seeds = np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+
+    if return_draws:
+        draws = np.empty((n_draws, 1 + n_source, n_depth))
+
+    # First pass: range of every rate at every depth (and every draw if requested)
+    n_points = (1 + n_source)*n_depth
+    lo = np.full(n_points, np.inf)
+    hi = np.full(n_points, -np.inf)
+    start = 0
+    for k, chunk_seed in zip(chunk_sizes, chunk_seeds):
+        chunk = _oc_draws(np.random.default_rng(chunk_seed), k, *inputs)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            lo = np.fmin(lo, np.nanmin(chunk.reshape(k, -1), axis=0))
+            hi = np.fmax(hi, np.nanmax(chunk.reshape(k, -1), axis=0))
+        if return_draws:
+            draws[start:start + k] = chunk
+        start += k
+
+    rate_qs = np.full((len(qs), n_points), np.nan)
+    valid = np.isfinite(lo)
+    if np.any(valid):
+        lo = np.where(valid, lo, 0.0)
+        span = np.where(hi > lo, hi - lo, 0.0)
+        scale = np.where(span > 0, span, 1.0)
+
+        # Second pass: the same draws, rescaled to [0, 1] on each rate's own range
+        sketch = QuantileSketch(n_points, 0.0, 1.0, tol)
+        for k, chunk_seed in zip(chunk_sizes, chunk_seeds):
+            chunk = _oc_draws(np.random.default_rng(chunk_seed), k, *inputs)
+            sketch.update(((chunk.reshape(k, -1) - lo) / scale).T)
+
+        rate_qs = lo + span*sketch.quantiles(qs)
+    rate_qs = rate_qs.reshape(len(qs), 1 + n_source, n_depth)
+
+    total_qs = rate_qs[:, 0]
+    source_qs = rate_qs[:, 1:].transpose(1, 0, 2)
+
+    if return_draws:
+        return total_qs, source_qs, draws
+
+    return total_qs, source_qs
+
+
+# Define function for converting RPO CO2 split yields to inverse cumulative yield (ICY)
+# icy[..., j] = 1/sum(co2_yield[..., 0:j+1]) for every split j, from one cumulative sum
+# Missing (NaN) splits add nothing to the cumulative yield and get a NaN ICY
+
+# co2_yield = (depth x split) array of RPO CO2 split yields, or any array with splits
+#             along the last axis, e.g. (replicate x depth x split) Monte Carlo draws
+# Returns an array of the same shape
+def inverse_cumulative_yield(co2_yield):
+
+    co2_yield = np.asarray(co2_yield, dtype=float)
+
+    with np.errstate(divide='ignore'):
+        icy = 1/np.nancumsum(co2_yield, axis=-1)
+    icy[np.isnan(co2_yield)] = np.nan
+
+    return icy
+
+
+# Define function for calculating the RPO CO2 yield-weighted average (bulk) Fm
+# Splits missing either a yield or an Fm value are left out of the average
+
+# co2_yield = (depth x split) array of RPO CO2 split yields (or splits along the last
+#             axis of any array, e.g. (replicate x depth x split))
+# fm = Fm of each split, same shape as co2_yield
+# Returns an array with the split axis removed (NaN where no split has both values)
+def fm_bulk(co2_yield, fm):
+
+    co2_yield = np.asarray(co2_yield, dtype=float)
+    fm = np.asarray(fm, dtype=float)
+
+    weights = np.where(np.isnan(fm), np.nan, co2_yield)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        bulk = np.nansum(weights*fm, axis=-1)/np.nansum(weights, axis=-1)
+    bulk[np.all(np.isnan(weights), axis=-1)] = np.nan
+
+    return bulk
+
+
+# Define batched least-squares regression and Pearson correlation
+# Fits y = slope*x + intercept to every row of stacked (series x point) arrays at once
+# with closed-form sums, e.g. the ICY fit of every depth, or thousands of bootstrap
+# replicates of a fit in one call
+# Points where x, y or the weight is NaN are left out of their row (e.g. depths with
+# four splits)
+# With weights, the fit is weighted least squares and r the weighted correlation
+# p values are two-sided, as in scipy.stats.pearsonr
+
+# x, y = arrays with points along the last axis (broadcast against each other)
+# weights = weight of each point, e.g. 1/sigma**2 (None for ordinary least squares)
+# Returns (slope, intercept, r, p), each with the point axis removed
+def linear_fit(x, y, weights=None):
+
+    if weights is None:
+        weights = 1.0
+    x, y, weights = np.broadcast_arrays(
+        np.asarray(x, dtype=float), np.asarray(y, dtype=float), np.asarray(weights, dtype=float)
+    )
+
+    valid = ~(np.isnan(x) | np.isnan(y) | np.isnan(weights))
+    n = valid.sum(axis=-1)
+    w = np.where(valid, weights, 0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        w_sum = w.sum(axis=-1)
+        x_mean = np.einsum('...i,...i->...', w, np.where(valid, x, 0))/w_sum
+        y_mean = np.einsum('...i,...i->...', w, np.where(valid, y, 0))/w_sum
+        dx = np.where(valid, x - x_mean[..., None], 0)
+        dy = np.where(valid, y - y_mean[..., None], 0)
+
+        sxx = np.einsum('...i,...i,...i->...', w, dx, dx)
+        sxy = np.einsum('...i,...i,...i->...', w, dx, dy)
+        syy = np.einsum('...i,...i,...i->...', w, dy, dy)
+
+        slope = sxy/sxx
+        intercept = y_mean - slope*x_mean
+        r = np.clip(sxy/np.sqrt(sxx*syy), -1, 1)
+
+        # Student t test of r with n - 2 degrees of freedom
+        dof = n - 2
+        t = np.abs(r)*np.sqrt(dof/((1 - r)*(1 + r)))
+        p = 2*scipy.stats.t.sf(t, np.where(dof > 0, dof, np.nan))
+
+    # Two points always lie on a line (pearsonr gives p = 1)
+    p = np.where(n == 2, 1.0, p)[()]
+
+    return slope, intercept, r, p
+
+
+# Define engine for ICY y-intercepts with confidence intervals
+# Fits y vs. ICY for every depth by least squares weighted by 1/y_sd**2, then refits
+# n_replicates replicates of every depth in one linear_fit call:
+# method='montecarlo' redraws every y from a normal distribution with its y_sd,
+# method='bootstrap' resamples the splits of each depth with replacement
+# Replicates are drawn chunk_size at a time to bound memory use
+
+# icy = (depth x split) inverse cumulative yields (see inverse_cumulative_yield)
+# y = (depth x split) RPO CO2 14C values, e.g. fm_todel14c(fm_arr, yc)
+# y_sd = (depth x split) uncertainties of y (None fits without weights)
+# n_replicates = number of Monte Carlo or bootstrap replicates
+# qs = quantiles of the replicate intercepts to return
+# method = 'montecarlo' or 'bootstrap'
+# seed = random seed
+# chunk_size = number of replicates fitted at once
+# Returns (slope, intercept, intercept_qs): the fitted slope and intercept of each depth and a
+# (len(qs) x depth) array of replicate intercept quantiles
+def icy_intercepts(
+    icy, y, y_sd=None,
+    n_replicates=10000,
+    qs=(0.025, 0.5, 0.975),
+    method='montecarlo',
+    seed=0,
+    chunk_size=10000
+):
+
+    icy = np.asarray(icy, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    if y_sd is None:
+        y_sd = np.zeros(y.shape)
+        weights = None
+    else:
+        y_sd = np.asarray(y_sd, dtype=float)
+        with np.errstate(divide='ignore'):
+            weights = 1/y_sd**2
+
+    if method not in ('montecarlo', 'bootstrap'):
+        raise ValueError("method must be 'montecarlo' or 'bootstrap'")
+    if method == 'montecarlo' and weights is None:
+        raise ValueError("method='montecarlo' needs y_sd")
+
+    slope, intercept, r, p = linear_fit(icy, y, weights)
+
+    rng = np.random.default_rng(seed)
+    intercepts = np.empty((n_replicates,) + y.shape[:-1])
+
+    for start in range(0, n_replicates, chunk_size):
+        k = min(chunk_size, n_replicates - start)
+
+        if method == 'montecarlo':
+            x_rep = icy
+            y_rep = rng.normal(y, y_sd, size=(k,) + y.shape)
+            w_rep = weights
+        else:
+            # Resample among the splits each depth actually has
+            valid = ~(np.isnan(icy) | np.isnan(y))
+            n_valid = valid.sum(axis=-1)
+            order = np.argsort(~valid, axis=-1, kind='stable')
+            picks = np.floor(rng.random((k,) + y.shape)*n_valid[..., None]).astype(int)
+            idx = np.take_along_axis(np.broadcast_to(order, picks.shape), picks, axis=-1)
+            x_rep = np.take_along_axis(np.broadcast_to(icy, idx.shape), idx, axis=-1)
+            y_rep = np.take_along_axis(np.broadcast_to(y, idx.shape), idx, axis=-1)
+            w_rep = None if weights is None else np.take_along_axis(
+                np.broadcast_to(weights, idx.shape), idx, axis=-1
+            )
+
+        intercepts[start:start + k] = linear_fit(x_rep, y_rep, w_rep)[1]
+
+    # Bootstrap resamples with a single distinct ICY value have no fit (NaN)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        intercept_qs = np.nanquantile(intercepts, qs, axis=0)
+
+    return slope, intercept, intercept_qs
+
+
+# Files written by MixSIAR output_JAGS (summary_name/diag_name in cf8_rpo_mixsiar.R)
+MIXSIAR_SUMMARY_GLOB = 'summary_depth_*_split_*_statistics.txt'
+MIXSIAR_DIAGNOSTICS = 'diagnostics_depth_{depth}_split_{split}_output.txt'
+
+
+# Define function for reading the whitespace table that follows a line of a MixSIAR
+# output file, up to the next blank line
+# lines = lines of the file
+# start = index of the line after which the table (header line first) begins
+# Returns dictionary of row name: list of values
+def _mixsiar_table(lines, start):
+
+    i = start + 1
+    while i < len(lines) and not lines[i].strip():
+        i += 1
+
+    rows = {}
+    for line in lines[i + 1:]:
+        if not line.strip():
+            break
+        name, *values = line.split()
+        rows[name] = [float(value) for value in values]
+
+    return rows
+
+
+# Define function for parsing a MixSIAR summary statistics file
+# Returns (DIC, DataFrame of Mean, SD and quantiles with one row per source)
+def parse_mixsiar_summary(filename):
+
+    with open(filename) as f:
+        lines = f.read().splitlines()
+
+    dic = np.nan
+    for i, line in enumerate(lines):
+        if line.startswith('DIC ='):
+            dic = float(line.split('=')[1])
+            header = lines[i + 2].split()
+            rows = _mixsiar_table(lines, i)
+            break
+    else:
+        raise ValueError(filename + ' is not a MixSIAR summary statistics file')
+
+    summary = pd.DataFrame.from_dict(rows, orient='index', columns=header)
+    summary.index = [name.replace('p.global.', '') for name in summary.index]
+
+    return dic, summary
+
+
+# Define function for parsing a MixSIAR diagnostics file
+# Returns (Gelman-Rubin, Geweke) DataFrames of the p.global rows, in source order
+def parse_mixsiar_diagnostics(filename):
+
+    with open(filename) as f:
+        lines = f.read().splitlines()
+
+    tables = {}
+    for i, line in enumerate(lines):
+        if line.startswith('And here are the Gelman diagnostics for all variables'):
+            tables['gelman'] = (_mixsiar_table(lines, i), ['gelman_point', 'gelman_upper'])
+        elif line.startswith('And here are the Geweke diagnostics for all variables'):
+            n_chain = len(lines[i + 2].split())
+            tables['geweke'] = (
+                _mixsiar_table(lines, i), [f'geweke_chain{c + 1}' for c in range(n_chain)]
+            )
+
+    parsed = []
+    for key in ('gelman', 'geweke'):
+        rows, columns = tables.get(key, ({}, []))
+        rows = {name: values for name, values in rows.items() if name.startswith('p.global[')}
+        parsed.append(pd.DataFrame.from_dict(rows, orient='index', columns=columns))
+
+    return tuple(parsed)
+
+
+# Define function for parsing the summary and diagnostics files of one MixSIAR run
+# Returns long-format DataFrame with one row per source
+def _mixsiar_run(summary_file):
+
+    name = os.path.basename(summary_file)
+    depth, split = name[len('summary_depth_'):-len('_statistics.txt')].split('_split_')
+
+    dic, run = parse_mixsiar_summary(summary_file)
+    run.insert(0, 'source', run.index)
+    run.insert(0, 'split', split)
+    run.insert(0, 'depth', int(depth))
+    run['DIC'] = dic
+
+    diag_file = os.path.join(
+        os.path.dirname(summary_file), MIXSIAR_DIAGNOSTICS.format(depth=depth, split=split)
+    )
+    if os.path.exists(diag_file):
+        # p.global[k] is the k-th source of the summary table (missing rows give NaN)
+        for diag in parse_mixsiar_diagnostics(diag_file):
+            diag.index = [int(name[len('p.global['):-1]) - 1 for name in diag.index]
+            diag = diag.reindex(range(len(run)))
+            for column in diag.columns:
+                run[column] = diag[column].to_numpy()
+
+    return run.reset_index(drop=True)
+
+
+# Define function for parsing every MixSIAR run in a folder into one long-format table
+# folder = MixSIAR summary_diagnostics folder
+# workers = number of worker processes (1 parses serially in this process)
+# Returns DataFrame with columns depth, split, source, Mean, SD, quantiles, DIC,
+# gelman_point, gelman_upper and geweke_chain<n>, sorted by depth, split and source
+def parse_mixsiar_outputs(folder, workers=1):
+
+    summary_files = sorted(glob.glob(os.path.join(folder, MIXSIAR_SUMMARY_GLOB)))
+    if not summary_files:
+        raise FileNotFoundError('No MixSIAR summary statistics files in ' + folder)
+
+    if workers <= 1 or len(summary_files) < 2:
+        runs = [_mixsiar_run(summary_file) for summary_file in summary_files]
+    else:
+        if 'fork' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('fork')
+        else:
+            context = multiprocessing.get_context()
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            runs = list(pool.map(_mixsiar_run, summary_files))
+
+    results = pd.concat(runs, ignore_index=True)
+    results['split'] = results['split'].astype(str)
+
+    return results.sort_values(['depth', 'split', 'source'], kind='stable', ignore_index=True)
+
+
+# Process-wide cache of loaded MixSIAR results stores, keyed by absolute path
+# (and file modification time, so a rewritten store is reloaded)
+_mixsiar_store_cache = {}
+
+
+# Define function for writing MixSIAR results to a columnar .npz store
+# Each column is saved as its own array, so reads need no parsing
+# results = long-format DataFrame (parse_mixsiar_outputs, or batch_summary of the
+#           Python mixing model in cf8_rpo_mixsiar)
+# filename = .npz store file
+def write_mixsiar_store(results, filename):
+
+    results = results.sort_values(['depth', 'split', 'source'], kind='stable', ignore_index=True)
+
+    arrays = {'columns': np.array(list(results.columns))}
+    for i, column in enumerate(results.columns):
+        values = results[column]
+        if column in ('split', 'source') or values.dtype == object:
+            arrays[f'col{i}'] = values.astype(str).to_numpy().astype(str)
+        else:
+            arrays[f'col{i}'] = values.to_numpy()
 
-    return to14c
+    tmp_path = filename + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, filename)
 
 
-# Convert fraction modern values to delta 14C
-def fm_todel14c(fm, yc):
-    lam = 1/8267
-    fm_arr = np.array(fm)
-    todel14c = ((fm_arr * math.exp(lam*(1950-yc))) -1) * 1000
+# Define function for reading (filtered) MixSIAR results from a columnar .npz store
+# The store is loaded once per session; later reads only filter the cached columns
+# filename = .npz store file
+# depth, split, source = values (or lists of values) to keep (None keeps all)
+# Returns long-format DataFrame
+def read_mixsiar_store(filename, depth=None, split=None, source=None):
 
-    return todel14c
+    path = os.path.abspath(filename)
+    mtime = os.path.getmtime(path)
 
+    cached = _mixsiar_store_cache.get(path)
+    if cached is None or cached[0] != mtime:
+        with np.load(path) as store:
+            columns = store['columns'].tolist()
+            cached = (mtime, {column: store[f'col{i}'] for i, column in enumerate(columns)})
+        _mixsiar_store_cache[path] = cached
+    columns = cached[1]
 
-# Convert delta 14C to uncalibrated 14C yrs
-def del14c_to14c(del14c, yc):
-    lam = 1/8267
-    del14c_arr = np.array(del14c)
-    tofm = ((del14c/1000)+1)/(math.exp(lam*(1950-yc)))
-    to14c = fm_to14c(tofm)
+    keep = np.ones(len(columns['depth']), dtype=bool)
+    for column, wanted in (('depth', depth), ('split', split), ('source', source)):
+        if wanted is not None:
+            wanted = np.atleast_1d(wanted)
+            if column != 'depth':
+                wanted = wanted.astype(str)
+            keep &= np.isin(columns[column], wanted)
 
-    return to14c
+    return pd.DataFrame({column: values[keep] for column, values in columns.items()})
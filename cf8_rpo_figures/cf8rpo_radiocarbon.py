@@ -0,0 +1,409 @@
+# Postglacial carbon cycling history of a northeastern Baffin Island lake catchment inferred from ramped pyrolysis oxidation and radiocarbon dating
+
+# Manuscript authors: Kurt R. Lindberg, Elizabeth K. Thomas, Brad E. Rosenheim, Gifford H. Miller, Julio Sepulveda, Devon R. Firesinger,
+# Gregory A. de Wet, Benjamin V. Gaglioti
+
+# DOI: pending
+
+# Code Author: Kurt R. Lindberg
+
+# Radiocarbon conversions for cf8_rpo_figures Python scripts
+# Every conversion takes broadcastable arrays (values, 1 sigma uncertainties, collection
+# years), can write into preallocated out= arrays, and propagates 1 sigma either
+# analytically (first order) or by Monte Carlo
+
+
+# See cf8_rpo_conda_env.yml
+import os
+import numpy as np
+
+
+# Libby mean-life used for conventional 14C ages (yrs)
+LIBBY_MEAN_LIFE = 8033
+
+# Cambridge mean-life (5730/ln(2) yrs) used for decay since 1950 in delta 14C
+DECAY_MEAN_LIFE = 8267
+
+
+# Define function for adding a chunk of Monte Carlo deviations to running sums
+# sums = [count, sum, sum of squares] arrays of the deviations of each value
+# dev = (draw x ...) deviations from the central values (NaN draws are skipped)
+def _add_deviations(sums, dev):
+
+    valid = ~np.isnan(dev)
+    dev = np.where(valid, dev, 0)
+
+    sums[0] += valid.sum(axis=0)
+    sums[1] += dev.sum(axis=0)
+    sums[2] += np.einsum('i...,i...->...', dev, dev)
+
+
+# Define function for the 1 sigma (sample standard deviation) from running sums
+def _sums_to_sigma(sums, out=None):
+
+    count, dev_sum, dev_sumsq = sums
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        variance = (dev_sumsq - dev_sum**2/count)/(count - 1)
+
+    return np.sqrt(np.maximum(variance, 0), out=out)
+
+
+# Define function for propagating 1 sigma through a conversion by Monte Carlo
+# Draws are made chunk_size at a time and only running sums of the deviations from the
+# converted input values are kept, so memory use does not grow with n_draws
+
+# convert = conversion of values to apply to the draws (other arguments already bound)
+# values, sigma = input values and their 1 sigma (broadcastable)
+# central = converted input values
+# n_draws = number of Monte Carlo draws
+# seed = random seed
+# chunk_size = approximate number of converted values held in memory at once
+# out_sigma = optional output array for the 1 sigma
+def _mc_sigma(convert, values, sigma, central, n_draws, seed, chunk_size=2**22, out_sigma=None):
+
+    values, sigma, central = np.broadcast_arrays(values, sigma, central)
+
+    rng = np.random.default_rng(seed)
+    step = max(1, chunk_size // max(values.size, 1))
+    sums = [np.zeros(values.shape) for _ in range(3)]
+
+    for start in range(0, n_draws, step):
+        k = min(step, n_draws - start)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            dev = convert(rng.normal(values, sigma, size=(k,) + values.shape)) - central
+        _add_deviations(sums, dev)
+
+    return _sums_to_sigma(sums, out=out_sigma)
+
+
+# Define function for finishing a conversion: returns values only, or values with their
+# 1 sigma from the analytic formula or by Monte Carlo
+def _with_sigma(
+    converted, values, sigma, analytic, convert,
+    method, n_draws, seed, out_sigma
+):
+
+    if sigma is None:
+        return converted
+
+    if method == 'analytic':
+        converted_sigma = analytic(out_sigma)
+    elif method == 'montecarlo':
+        converted_sigma = _mc_sigma(
+            convert, values, sigma, converted, n_draws, seed, out_sigma=out_sigma
+        )
+    else:
+        raise ValueError("method must be 'analytic' or 'montecarlo'")
+
+    return converted, converted_sigma
+
+
+# Convert fraction modern values to uncalibrated (conventional) 14C yrs
+
+# fm = fraction modern values
+# sigma = 1 sigma uncertainty of fm (None returns the converted values only)
+# method = 'analytic' (first order) or 'montecarlo' propagation of sigma
+# n_draws, seed = Monte Carlo draws and random seed
+# out, out_sigma = optional output arrays for the converted values and their 1 sigma
+# Returns 14C yrs, or (14C yrs, 1 sigma) if sigma is given
+def fm_to14c(
+    fm, sigma=None, method='analytic', n_draws=10000, seed=0,
+    out=None, out_sigma=None
+):
+
+    fm = np.asarray(fm, dtype=float)
+
+    def convert(fm_values, out=None):
+        to14c = np.log(fm_values, out=out)
+        to14c *= -LIBBY_MEAN_LIFE
+        return to14c
+
+    def analytic(out_sigma):
+        return np.multiply(LIBBY_MEAN_LIFE, np.abs(sigma/fm), out=out_sigma)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        to14c = convert(fm, out=out)
+
+    return _with_sigma(to14c, fm, sigma, analytic, convert, method, n_draws, seed, out_sigma)
+
+
+# Convert fraction modern values to delta 14C (per mil), decay corrected to the
+# collection year
+
+# fm = fraction modern values
+# yc = year of collection (AD), broadcast against fm
+# sigma, method, n_draws, seed, out, out_sigma = see fm_to14c
+# Returns delta 14C, or (delta 14C, 1 sigma) if sigma is given
+def fm_todel14c(
+    fm, yc, sigma=None, method='analytic', n_draws=10000, seed=0,
+    out=None, out_sigma=None
+):
+
+    fm = np.asarray(fm, dtype=float)
+    decay = np.exp((1950 - np.asarray(yc, dtype=float))/DECAY_MEAN_LIFE)
+
+    def convert(fm_values, out=None):
+        todel14c = np.multiply(fm_values, decay, out=out)
+        todel14c -= 1
+        todel14c *= 1000
+        return todel14c
+
+    def analytic(out_sigma):
+        return np.multiply(1000*decay, np.abs(sigma)*np.ones_like(fm), out=out_sigma)
+
+    todel14c = convert(fm, out=out)
+
+    return _with_sigma(todel14c, fm, sigma, analytic, convert, method, n_draws, seed, out_sigma)
+
+
+# Convert delta 14C (per mil) to uncalibrated (conventional) 14C yrs
+
+# del14c = delta 14C values, decay corrected to the collection year
+# yc = year of collection (AD), broadcast against del14c
+# sigma, method, n_draws, seed, out, out_sigma = see fm_to14c
+# Returns 14C yrs, or (14C yrs, 1 sigma) if sigma is given
+def del14c_to14c(
+    del14c, yc, sigma=None, method='analytic', n_draws=10000, seed=0,
+    out=None, out_sigma=None
+):
+
+    del14c = np.asarray(del14c, dtype=float)
+    decay = np.exp((1950 - np.asarray(yc, dtype=float))/DECAY_MEAN_LIFE)
+
+    def convert(del14c_values, out=None):
+        tofm = np.divide(del14c_values, 1000*decay, out=out)
+        tofm += 1/decay
+        return fm_to14c(tofm, out=tofm if np.ndim(tofm) else None)
+
+    def analytic(out_sigma):
+        return np.multiply(LIBBY_MEAN_LIFE, np.abs(sigma/(del14c + 1000)), out=out_sigma)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        to14c = convert(del14c, out=out)
+
+    return _with_sigma(to14c, del14c, sigma, analytic, convert, method, n_draws, seed, out_sigma)
+
+
+# Calibration curves read this session, by absolute path
+# {path: {'mtime': ..., 'curve': (cal_bp, age14c, sigma), 'grids': {grid key: (mu, sigma)}}}
+_calcurve_cache = {}
+
+
+# Define function for reading a radiocarbon calibration curve file, e.g. intcal20.14c
+# Curves are not distributed with this code; download the .14c file (e.g. from
+# https://intcal.org) and pass its path
+# Comment lines start with '#'; the first three comma-separated columns are
+# calendar age (cal yr BP), 14C age and 1 sigma (14C yrs)
+
+# filename = path of the calibration curve file
+# Returns (cal_bp, age14c, sigma) sorted by increasing calendar age
+def read_calcurve(filename='intcal20.14c'):
+
+    path = os.path.abspath(filename)
+    if not os.path.exists(path):
+        raise FileNotFoundError(
+            f'Calibration curve {filename} not found; download it (e.g. from https://intcal.org) '
+            'and pass its path'
+        )
+
+    mtime = os.path.getmtime(path)
+    cached = _calcurve_cache.get(path)
+    if cached is None or cached['mtime'] != mtime:
+        curve = np.loadtxt(path, delimiter=',', comments='#', usecols=(0, 1, 2), ndmin=2)
+        curve = curve[np.argsort(curve[:, 0], kind='stable')]
+        cached = {'mtime': mtime, 'curve': (curve[:, 0], curve[:, 1], curve[:, 2]), 'grids': {}}
+        _calcurve_cache[path] = cached
+
+    return cached['curve']
+
+
+# Define function for getting a calibration curve interpolated to a calendar grid
+# Interpolated curves are cached per curve file and grid, so repeated calibrations on
+# the same grid skip the interpolation
+
+# filename = path of the calibration curve file
+# cal_grid = increasing calendar ages (cal yr BP)
+# Returns (mu, sigma): curve 14C age and 1 sigma at each calendar age
+def _calcurve_on_grid(filename, cal_grid):
+
+    cal_bp, age14c, sigma = read_calcurve(filename)
+    grids = _calcurve_cache[os.path.abspath(filename)]['grids']
+
+    key = (len(cal_grid), cal_grid[0], cal_grid[-1], hash(cal_grid.tobytes()))
+    if key not in grids:
+        mu_grid = np.interp(cal_grid, cal_bp, age14c, left=np.nan, right=np.nan)
+        sigma_grid = np.interp(cal_grid, cal_bp, sigma, left=np.nan, right=np.nan)
+        mu_grid.flags.writeable = False
+        sigma_grid.flags.writeable = False
+        grids[key] = (mu_grid, sigma_grid)
+
+    return grids[key]
+
+
+# Define vectorized radiocarbon calibration
+# The likelihood of every date at every calendar age of a shared grid is computed as one
+# (date x calendar age) matrix, in blocks of dates to bound the size of temporaries:
+# p(t) ~ exp(-(age14c - mu(t))**2/(2*(sigma**2 + sigma_curve(t)**2)))/sqrt(sigma**2 + sigma_curve(t)**2)
+# and each density is normalized to integrate to 1 over the grid
+
+# age14c, sigma = uncalibrated 14C ages and 1 sigma (broadcastable, any shape, e.g. depth x split)
+# calcurve = path of the calibration curve file (see read_calcurve)
+# cal_grid = calendar ages to evaluate (default: the whole curve every step yrs)
+# step = spacing of the default calendar grid (yrs)
+# chunk_size = approximate number of matrix elements computed per block
+# Returns (cal_grid, pdf): pdf has the broadcast shape of the dates plus a last axis over cal_grid
+def calibrate(age14c, sigma, calcurve='intcal20.14c', cal_grid=None, step=1, chunk_size=2**22):
+
+    age14c, sigma = np.broadcast_arrays(np.asarray(age14c, dtype=float), np.asarray(sigma, dtype=float))
+
+    if cal_grid is None:
+        cal_bp = read_calcurve(calcurve)[0]
+        cal_grid = np.arange(np.ceil(cal_bp[0]), cal_bp[-1] + step/2, step)
+    cal_grid = np.asarray(cal_grid, dtype=float)
+
+    mu_grid, sigma_grid = _calcurve_on_grid(calcurve, cal_grid)
+    variance_grid = sigma_grid**2
+    widths = np.gradient(cal_grid) if len(cal_grid) > 1 else np.ones(1)
+
+    dates = age14c.ravel()
+    dates_sigma = sigma.ravel()
+    pdf = np.empty((len(dates), len(cal_grid)))
+    block = max(1, chunk_size // max(len(cal_grid), 1))
+
+    for start in range(0, len(dates), block):
+        rows = slice(start, start + block)
+        variance = dates_sigma[rows, None]**2 + variance_grid
+        likelihood = np.exp(-(dates[rows, None] - mu_grid)**2/(2*variance))
+        likelihood /= np.sqrt(variance)
+        np.nan_to_num(likelihood, copy=False)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            likelihood /= (likelihood @ widths)[:, None]
+        pdf[rows] = likelihood
+
+    return cal_grid, pdf.reshape(age14c.shape + (len(cal_grid),))
+
+
+# Define function for summarizing calibrated densities by their median calendar age
+
+# cal_grid, pdf = see calibrate
+# Returns the median calendar age of every date (shape of pdf without the last axis)
+def calibrated_median(cal_grid, pdf):
+
+    cal_grid = np.asarray(cal_grid, dtype=float)
+    widths = np.gradient(cal_grid) if len(cal_grid) > 1 else np.ones(1)
+    cdf = np.cumsum(np.asarray(pdf, dtype=float)*widths, axis=-1)
+
+    idx = np.minimum((cdf < 0.5).sum(axis=-1), len(cal_grid) - 1)
+
+    return np.where(np.isnan(cdf[..., -1]), np.nan, cal_grid[idx])[()]
+
+
+# Define function for highest posterior density (HPD) ranges of calibrated dates
+# The density threshold of every date is found at once from its sorted densities;
+# the calendar ranges above the threshold are then read off row by row
+
+# cal_grid, pdf = see calibrate
+# prob = probability enclosed by the ranges (e.g. 0.954 for 2 sigma)
+# Returns a list (one entry per date, in flattened order) of (n_ranges x 3) arrays holding
+# the younger and older bound of each range (cal yr BP) and the probability it encloses
+def hpd_ranges(cal_grid, pdf, prob=0.954):
+
+    cal_grid = np.asarray(cal_grid, dtype=float)
+    widths = np.gradient(cal_grid) if len(cal_grid) > 1 else np.ones(1)
+    density = np.reshape(np.asarray(pdf, dtype=float), (-1, len(cal_grid)))
+    mass = density*widths
+
+    # Smallest density still needed to reach prob, for every date (grid points are
+    # taken in order of decreasing density, each adding its probability mass)
+    order = np.argsort(-density, axis=1, kind='stable')
+    sorted_density = np.take_along_axis(density, order, axis=1)
+    cumulative = np.cumsum(np.take_along_axis(mass, order, axis=1), axis=1)
+    last = np.minimum((cumulative < prob).sum(axis=1), len(cal_grid) - 1)
+    threshold = sorted_density[np.arange(len(density)), last]
+
+    in_range = density >= threshold[:, None]
+    edges = np.diff(in_range.astype(np.int8), axis=1, prepend=0, append=0)
+
+    ranges = []
+    for i in range(len(density)):
+        if np.isnan(cumulative[i, -1]):
+            ranges.append(np.empty((0, 3)))
+            continue
+        starts = np.flatnonzero(edges[i] == 1)
+        stops = np.flatnonzero(edges[i] == -1)
+        range_prob = np.add.reduceat(np.where(in_range[i], mass[i], 0), starts) if len(starts) else []
+        ranges.append(np.column_stack([cal_grid[starts], cal_grid[stops - 1], range_prob]))
+
+    return ranges
+
+
+# Define function for the constant-contamination blank mass balance
+# fm_sample = (fm*mass - blank_fm*blank_mass)/(mass - blank_mass)
+def _blank_mass_balance(fm, mass, blank_mass, blank_fm):
+
+    return (fm*mass - blank_fm*blank_mass)/(mass - blank_mass)
+
+
+# Define batch blank correction of RPO CO2 splits (constant contamination model)
+# Every split of every depth is corrected in one vectorized pass, and the uncertainty of
+# the measured Fm, the blank mass and the blank Fm is propagated by Monte Carlo
+# Blank inputs are broadcast against the splits: a scalar blank is one process blank
+# drawn once per Monte Carlo draw and shared by all splits (as a constant contamination
+# should be), while per-split blank arrays are drawn independently for each split
+# Blank masses are truncated at 0; draws giving a non-positive corrected Fm are left out
+
+# fm, fm_sigma = measured (uncorrected) Fm and 1 sigma, e.g. (depth x split)
+# mass = measured CO2 amount of each split (same units as blank_mass, e.g. umol or ug C)
+# blank_mass, blank_mass_sigma = blank CO2 amount and its 1 sigma
+# blank_fm, blank_fm_sigma = blank Fm and its 1 sigma
+# n_draws = number of Monte Carlo draws
+# seed = random seed
+# chunk_size = approximate number of corrected values held in memory at once
+# Returns (fm_corr, fm_corr_sigma, age14c, age14c_sigma): blank-corrected Fm and 14C yrs
+# with their Monte Carlo 1 sigma
+def blank_correct(
+    fm, fm_sigma, mass,
+    blank_mass, blank_mass_sigma, blank_fm, blank_fm_sigma,
+    n_draws=10000, seed=0, chunk_size=2**22
+):
+
+    fm, fm_sigma, mass = np.broadcast_arrays(
+        np.asarray(fm, dtype=float), np.asarray(fm_sigma, dtype=float), np.asarray(mass, dtype=float)
+    )
+    blank_mass, blank_mass_sigma = np.broadcast_arrays(
+        np.asarray(blank_mass, dtype=float), np.asarray(blank_mass_sigma, dtype=float)
+    )
+    blank_fm, blank_fm_sigma = np.broadcast_arrays(
+        np.asarray(blank_fm, dtype=float), np.asarray(blank_fm_sigma, dtype=float)
+    )
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fm_corr = _blank_mass_balance(fm, mass, blank_mass, blank_fm)
+        fm_corr = np.where(fm_corr <= 0, np.nan, fm_corr)
+        age14c = fm_to14c(fm_corr)
+
+    shape = fm_corr.shape
+    rng = np.random.default_rng(seed)
+    step = max(1, chunk_size // max(fm_corr.size, 1))
+    fm_sums = [np.zeros(shape) for _ in range(3)]
+    age_sums = [np.zeros(shape) for _ in range(3)]
+
+    for start in range(0, n_draws, step):
+        k = min(step, n_draws - start)
+
+        fm_draw = rng.normal(fm, fm_sigma, size=(k,) + fm.shape)
+        blank_mass_draw = np.maximum(
+            rng.normal(blank_mass, blank_mass_sigma, size=(k,) + blank_mass.shape), 0
+        ).reshape((k,) + (1,)*(len(shape) - blank_mass.ndim) + blank_mass.shape)
+        blank_fm_draw = rng.normal(
+            blank_fm, blank_fm_sigma, size=(k,) + blank_fm.shape
+        ).reshape((k,) + (1,)*(len(shape) - blank_fm.ndim) + blank_fm.shape)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            fm_corr_draw = _blank_mass_balance(fm_draw, mass, blank_mass_draw, blank_fm_draw)
+            fm_corr_draw[fm_corr_draw <= 0] = np.nan
+            _add_deviations(fm_sums, fm_corr_draw - fm_corr)
+            _add_deviations(age_sums, fm_to14c(fm_corr_draw) - age14c)
+
+    return fm_corr[()], _sums_to_sigma(fm_sums), age14c, _sums_to_sigma(age_sums)
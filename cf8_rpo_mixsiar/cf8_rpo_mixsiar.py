@@ -0,0 +1,1069 @@
+## Lake CF8 MixSIAR - OC Endmember Contributions (Python engine)
+# Endmembers: Contemporaneous aquatic biomass
+#             Postglacial (<12.5 ka) soil
+#             MIS 5 soil
+
+# Postglacial carbon cycling history of a northeastern Baffin Island lake catchment inferred from ramped pyrolysis oxidation and radiocarbon dating
+
+# Manuscript authors: Kurt R. Lindberg, Elizabeth K. Thomas, Brad E. Rosenheim, Gifford H. Miller, Julio Sepulveda, Devon R. Firesinger,
+# Gregory A. de Wet, Benjamin V. Gaglioti
+
+# DOI: pending
+
+# Code Author: Kurt R. Lindberg
+
+# Python version of the MixSIAR model in cf8_rpo_mixsiar.R (Stock et al., 2018)
+# Reads the same mix/, source/ and discr/ csv files and fits the same model:
+#   p.global ~ Dirichlet(alpha)
+#   source means ~ Normal(Meand13C/MeanFM, SD^2/n), source precisions ~ chisq(n)/(SD^2*(n-1))
+#   mixture ~ Normal(sum(p*(source mean + discr mean)), sum(p^2*(source var + discr SD^2)))
+# i.e. "means" source data, process error only (resid_err = FALSE, process_err = TRUE)
+# The source means are integrated out analytically and the posterior is sampled by
+# vectorized importance sampling from the Dirichlet prior (or solved exactly on a grid for
+# two-source mixtures), so no R or JAGS install is needed
+
+
+# See cf8_rpo_conda_env.yml
+import os
+import re
+import glob
+import json
+import hashlib
+import inspect
+import warnings
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+import scipy.special
+import scipy.stats
+
+
+# Tracers in the mix/source/discr csv files
+ISO_NAMES = ('d13C', 'FM')
+
+# Quantiles reported in the MixSIAR summary statistics files
+SUMMARY_QUANTILES = (0.025, 0.05, 0.25, 0.5, 0.75, 0.95, 0.975)
+
+# Folder (inside cf8_rpo_mixsiar) holding the finished batch runs
+CHECKPOINT_DIR = 'python_output'
+
+# Checkpoint layout/model version (bump when a change alters the results of run_model)
+_CHECKPOINT_VERSION = 4
+
+# Importance draws whose log weight is more than this below the largest are not kept
+# for reweighting (their weight is < 1e-13 of the largest)
+PROPOSAL_LOG_WEIGHT_CUTOFF = 30
+
+
+## Import model input csv files
+
+# Define function for loading a mixture csv file (same role as MixSIAR load_mix_data)
+# filename = mix csv file (e.g. "mix/mix_depth_1_split_1.csv")
+# iso_names = tracer columns
+# Returns (mixture x tracer) array
+def load_mix_data(filename, iso_names=ISO_NAMES):
+
+    mix = pd.read_csv(filename)
+
+    return mix[list(iso_names)].to_numpy(dtype=float)
+
+
+# Define function for loading a source csv file of means, SDs and sample sizes
+# (same role as MixSIAR load_source_data with data_type = "means")
+# filename = source csv file (e.g. "source/source_depth_1_split_1.csv")
+# iso_names = tracers
+# Returns dictionary of source names, (source x tracer) means and SDs, and (source,) n
+def load_source_data(filename, iso_names=ISO_NAMES):
+
+    source = pd.read_csv(filename)
+
+    return {
+        'source_names': source['source_names'].astype(str).tolist(),
+        'means': source[['Mean' + iso for iso in iso_names]].to_numpy(dtype=float),
+        'sds': source[['SD' + iso for iso in iso_names]].to_numpy(dtype=float),
+        'n': source['n'].to_numpy(dtype=float),
+    }
+
+
+# Define function for loading a discrimination factor csv file
+# (same role as MixSIAR load_discr_data)
+# filename = discr csv file (e.g. "discr/discr_depth_1_split_1.csv")
+# source = loaded source data, used to order the rows by source
+# iso_names = tracers
+# Returns dictionary of (source x tracer) discrimination means and SDs
+def load_discr_data(filename, source, iso_names=ISO_NAMES):
+
+    discr = pd.read_csv(filename).set_index('source_names')
+    discr = discr.loc[source['source_names']]
+
+    return {
+        'means': discr[['Mean' + iso for iso in iso_names]].to_numpy(dtype=float),
+        'sds': discr[['SD' + iso for iso in iso_names]].to_numpy(dtype=float),
+    }
+
+
+# Define function for loading the mix/source/discr csv files of one depth and CO2 split
+# depth = CF817-03 RPO depth (1-8)
+# split = CO2 split (1-5 or "bulk")
+# path = cf8_rpo_mixsiar directory
+# Returns (mix, source, discr)
+def load_run(depth, split, path='.', iso_names=ISO_NAMES):
+
+    run_name = _run_name(depth, split)
+
+    mix = load_mix_data(path + '/mix/mix_' + run_name + '.csv', iso_names)
+    source = load_source_data(path + '/source/source_' + run_name + '.csv', iso_names)
+    discr = load_discr_data(path + '/discr/discr_' + run_name + '.csv', source, iso_names)
+
+    return mix, source, discr
+
+
+## Mixing model
+
+# Define function for the log likelihood of the mixture data given source proportions
+# and source precisions, with the source means integrated out
+
+# p = (draw x source) proportions
+# src_var = (draw x source x tracer) source variances (1/precision)
+# mix, source, discr = loaded model inputs
+# Returns (draw,) log likelihood
+def _log_likelihood(p, src_var, mix, source, discr):
+
+    mix_mu = p @ (source['means'] + discr['means'])
+
+    # Source mean uncertainty (SD^2/n) adds to the process error variance
+    var = src_var + discr['sds']**2 + source['sds']**2/source['n'][:, None]
+    mix_var = np.einsum('dk,dkj->dj', p**2, var)
+
+    resid = mix[:, None, :] - mix_mu
+    loglik = -0.5*(np.log(2*np.pi*mix_var) + resid**2/mix_var)
+
+    return loglik.sum(axis=(0, 2))
+
+
+# Define function for drawing source proportions and source variances from the prior
+# rng = numpy random generator
+# k = number of draws
+# source = loaded source data
+# alpha = (source,) Dirichlet prior
+# Returns (k x source) proportions and (k x source x tracer) source variances
+def _prior_draws(rng, k, source, alpha):
+
+    p = rng.dirichlet(alpha, size=k)
+
+    # src_tau = chisq(n)/(SD^2*(n-1)), as in the MixSIAR JAGS model for source means data
+    n = source['n'][:, None]
+    tau = rng.chisquare(n, size=(k,) + source['sds'].shape)
+    src_var = source['sds']**2*(n - 1)/tau
+
+    return p, src_var
+
+
+# Define function for systematic resampling of weighted draws
+# Returns indices of n equally weighted posterior draws
+def _resample(rng, weights, n):
+
+    positions = (rng.random() + np.arange(n))/n
+    cumulative = np.cumsum(weights)
+    cumulative[-1] = 1
+
+    return np.searchsorted(cumulative, positions)
+
+
+# Define function for weighting prior draws by the likelihood, chunk_size at a time
+# Returns (k x source) proportions and (k,) log importance weights
+def _importance_draws(rng, k, mix, source, discr, alpha, chunk_size):
+
+    p = np.empty((k, len(alpha)))
+    log_w = np.empty(k)
+
+    for start in range(0, k, chunk_size):
+        stop = min(start + chunk_size, k)
+        p[start:stop], src_var = _prior_draws(rng, stop - start, source, alpha)
+        log_w[start:stop] = _log_likelihood(p[start:stop], src_var, mix, source, discr)
+
+    return p, log_w
+
+
+# Define function for normalizing log importance weights
+# Returns (normalized weights, log mean of the unnormalized weights)
+def _normalize(log_w):
+
+    log_w_max = log_w.max()
+    weights = np.exp(log_w - log_w_max)
+    weight_sum = weights.sum()
+
+    return weights/weight_sum, log_w_max + np.log(weight_sum/len(log_w))
+
+
+# Define function for adding weighted draws to the running sums of an importance
+# sampling chain, so convergence checks do not revisit earlier draws
+# Sums are kept relative to the chain's largest log weight and rescaled when it grows
+# sums = dictionary of 'max', 'w' (sum of weights), 'wp', 'wp2' (weighted sums of p and
+#        p^2) and 'w2' (sum of squared weights)
+def _add_weights(sums, p, log_w):
+
+    new_max = max(sums['max'], log_w.max())
+    scale = np.exp(sums['max'] - new_max)
+    weights = np.exp(log_w - new_max)
+
+    sums['w'] = sums['w']*scale + weights.sum()
+    sums['wp'] = sums['wp']*scale + weights @ p
+    sums['wp2'] = sums['wp2']*scale + weights @ p**2
+    sums['w2'] = sums['w2']*scale**2 + weights @ weights
+    sums['max'] = new_max
+
+
+# Define function for the convergence diagnostics of independent importance sampling chains
+# R-hat (Gelman-Rubin) uses the weighted mean and variance of each chain, with the chains'
+# mean effective sample size in place of the chain length
+# chain_sums = list of running sums of each chain (see _add_weights)
+# Returns ((source,) R-hat, pooled effective sample size)
+def _importance_diagnostics(chain_sums):
+
+    means = np.array([sums['wp']/sums['w'] for sums in chain_sums])
+    variances = np.array([sums['wp2']/sums['w'] for sums in chain_sums]) - means**2
+    ess = np.array([sums['w']**2/sums['w2'] for sums in chain_sums])
+
+    n = ess.mean()
+    within = variances.mean(axis=0)
+    var_plus = (n - 1)/n*within + np.var(means, axis=0, ddof=1)
+
+    # Pool the chains' sums on a common log weight scale
+    scale = np.exp(np.array([sums['max'] for sums in chain_sums]) - max(sums['max'] for sums in chain_sums))
+    pooled_ess = np.sum([sums['w'] for sums in chain_sums]*scale)**2/np.sum(
+        [sums['w2'] for sums in chain_sums]*scale**2
+    )
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.sqrt(var_plus/within), pooled_ess
+
+
+# Define function for the exact grid posterior of a two-source mixture
+# With two sources the posterior is a function of one proportion, so it is evaluated on
+# n_grid cells of p1 in (0, 1). The source means are integrated out analytically (see
+# _log_likelihood) and the source precisions (chisq(n)/(SD^2*(n-1))) by generalized
+# Gauss-Laguerre quadrature with n_nodes nodes per source. Posterior draws are the
+# inverse posterior CDF at n_post evenly spaced probabilities, so their quantiles are the
+# grid posterior quantiles
+
+# mix, source, discr = loaded model inputs (two sources)
+# alpha = (2,) Dirichlet prior
+# n_post = number of posterior draws returned
+# n_grid = number of grid cells
+# n_nodes = quadrature nodes per source
+# Returns (n_post x 2) posterior draws and log marginal likelihood
+def _grid_posterior(mix, source, discr, alpha, n_post, n_grid, n_nodes):
+
+    edges = np.linspace(0, 1, n_grid + 1)
+    p1 = (edges[:-1] + edges[1:])/2
+
+    # chisq(n)/2 ~ Gamma(n/2): nodes and log weights of each source's precision
+    n = source['n']
+    chisq = np.empty((n_nodes, 2))
+    log_weights = np.empty((n_nodes, 2))
+    for k in range(2):
+        nodes, weights = scipy.special.roots_genlaguerre(n_nodes, n[k]/2 - 1)
+        chisq[:, k] = 2*nodes
+        log_weights[:, k] = np.log(weights) - scipy.special.gammaln(n[k]/2)
+
+    # (node x source x tracer) source variances
+    var = (
+        source['sds']**2*(n[:, None] - 1)/chisq[:, :, None]
+        + discr['sds']**2 + source['sds']**2/n[:, None]
+    )
+
+    # (grid x tracer) mixture mean and (node x node x grid x tracer) mixture variance
+    means = source['means'] + discr['means']
+    mix_mu = p1[:, None]*means[0] + (1 - p1[:, None])*means[1]
+    mix_var = (
+        (p1**2)[:, None]*var[:, None, None, 0, :]
+        + ((1 - p1)**2)[:, None]*var[None, :, None, 1, :]
+    )
+
+    loglik = np.zeros(mix_var.shape)
+    for mix_point in mix:
+        loglik -= 0.5*(np.log(2*np.pi*mix_var) + (mix_point - mix_mu)**2/mix_var)
+    loglik += (log_weights[:, None, 0] + log_weights[None, :, 1])[:, :, None, None]
+
+    # Sum the quadrature over the nodes of each tracer, then multiply tracers
+    loglik = loglik.reshape(n_nodes**2, -1)
+    loglik_max = loglik.max(axis=0)
+    loglik = np.log(np.exp(loglik - loglik_max).sum(axis=0)) + loglik_max
+    log_post = loglik.reshape(n_grid, -1).sum(axis=1) + scipy.stats.beta.logpdf(p1, alpha[0], alpha[1])
+
+    log_post_max = log_post.max()
+    post = np.exp(log_post - log_post_max)
+    post_sum = post.sum()
+
+    cdf = np.concatenate([[0], np.cumsum(post/post_sum)])
+    draws = np.interp((np.arange(n_post) + 0.5)/n_post, cdf, edges)
+
+    return np.stack([draws, 1 - draws], axis=1), log_post_max + np.log(post_sum/n_grid)
+
+
+# Run the mixing model for one mixture by importance sampling from the prior
+# Prior draws are weighted by the likelihood chunk_size at a time and resampled into
+# equally weighted posterior draws
+
+# With adaptive=True the run length is set by convergence instead of n_draws:
+# n_chains independent chains each add increment draws at a time until R-hat of every
+# source is <= rhat_target and the pooled effective sample size is >= ess_target,
+# or until max_draws draws (all chains) are used
+
+# Mixtures with two sources are solved exactly on a grid instead (see _grid_posterior)
+# unless grid=False
+
+# mix, source, discr = loaded model inputs (see load_run)
+# alpha = Dirichlet prior (scalar or one value per source; 1 = uniform, as plot_prior(alpha.prior = 1))
+# n_draws = number of prior (proposal) draws
+# n_post = number of posterior draws returned
+# seed = random seed
+# chunk_size = number of prior draws weighted at once
+# adaptive = run in increments until the convergence targets are met
+# n_chains, increment = adaptive chains and draws added per chain per increment
+# rhat_target, ess_target = adaptive stopping targets
+# max_draws = adaptive hard cap on the total number of prior draws
+# grid = use the exact grid posterior for two-source mixtures
+# n_grid, n_nodes = grid cells and quadrature nodes per source of the grid posterior
+# Returns dictionary of source names, (n_post x source) posterior draws of p.global,
+# alpha, method ('importance' or 'grid'), effective sample size, log marginal likelihood
+# and number of prior draws used (0 for the grid; adaptive runs add (source,) R-hat and
+# whether the targets were met; importance runs add the unresampled 'proposal_draws' and
+# their 'log_weights', see PROPOSAL_LOG_WEIGHT_CUTOFF)
+def run_model(
+    mix, source, discr, alpha=1, n_draws=200000, n_post=10000, seed=0,
+    chunk_size=50000, adaptive=False, n_chains=4, increment=10000,
+    rhat_target=1.01, ess_target=5000, max_draws=2000000,
+    grid=True, n_grid=1000, n_nodes=16
+):
+
+    n_sources = len(source['source_names'])
+    alpha = np.broadcast_to(np.asarray(alpha, dtype=float), (n_sources,))
+
+    if grid and n_sources == 2:
+        draws, log_evidence = _grid_posterior(mix, source, discr, alpha, n_post, n_grid, n_nodes)
+        return {
+            'source_names': source['source_names'],
+            'draws': draws,
+            'alpha': alpha,
+            'method': 'grid',
+            'ess': n_post,
+            'log_evidence': log_evidence,
+            'n_draws': 0,
+        }
+
+    if not adaptive:
+        rng = np.random.default_rng(seed)
+        p, log_w = _importance_draws(rng, n_draws, mix, source, discr, alpha, chunk_size)
+        extra = {}
+    else:
+        seeds = np.random.SeedSequence(seed).spawn(n_chains + 1)
+        rng = np.random.default_rng(seeds[0])
+        chain_rngs = [np.random.default_rng(chain_seed) for chain_seed in seeds[1:]]
+        chain_sums = [
+            {'max': -np.inf, 'w': 0., 'wp': np.zeros(n_sources), 'wp2': np.zeros(n_sources), 'w2': 0.}
+            for _ in range(n_chains)
+        ]
+        p_blocks = []
+        log_w_blocks = []
+
+        while True:
+            for chain_rng, sums in zip(chain_rngs, chain_sums):
+                p_new, log_w_new = _importance_draws(
+                    chain_rng, increment, mix, source, discr, alpha, chunk_size
+                )
+                _add_weights(sums, p_new, log_w_new)
+                p_blocks.append(p_new)
+                log_w_blocks.append(log_w_new)
+
+            rhat, pooled_ess = _importance_diagnostics(chain_sums)
+            converged = bool(np.all(rhat <= rhat_target) and pooled_ess >= ess_target)
+            n_used = len(log_w_blocks)*increment
+            if converged or n_used + n_chains*increment > max_draws:
+                break
+
+        p = np.concatenate(p_blocks)
+        log_w = np.concatenate(log_w_blocks)
+        extra = {'rhat': rhat, 'converged': converged}
+
+    weights, log_evidence = _normalize(log_w)
+    keep = log_w >= log_w.max() - PROPOSAL_LOG_WEIGHT_CUTOFF
+
+    return {
+        'source_names': source['source_names'],
+        'draws': p[_resample(rng, weights, n_post)],
+        'alpha': alpha,
+        'method': 'importance',
+        'ess': 1/np.sum(weights**2),
+        'log_evidence': log_evidence,
+        'n_draws': len(log_w),
+        'proposal_draws': p[keep],
+        'log_weights': log_w[keep] - log_w.max(),
+        **extra,
+    }
+
+
+# Define function for MixSIAR-style summary statistics of posterior draws
+# result = output of run_model
+# qs = quantiles
+# Returns DataFrame of Mean, SD and quantiles with rows p.global.<source>
+def summary_statistics(result, qs=SUMMARY_QUANTILES):
+
+    draws = result['draws']
+
+    summary = pd.DataFrame(
+        np.quantile(draws, qs, axis=0).T,
+        columns=[f'{q:.1%}'.replace('.0%', '%') for q in qs],
+        index=['p.global.' + name for name in result['source_names']],
+    )
+    summary.insert(0, 'SD', draws.std(axis=0, ddof=1))
+    summary.insert(0, 'Mean', draws.mean(axis=0))
+
+    return summary
+
+
+## Batch runs
+
+# Define function for the run name of a depth and CO2 split (as in the csv file names)
+def _run_name(depth, split):
+
+    return 'depth_' + str(depth) + '_split_' + str(split)
+
+
+# Define function for sorting runs by depth, then CO2 split (numbered splits before bulk)
+def _run_order(run):
+
+    depth, split = run
+
+    return (int(depth), 0 if str(split).isdigit() else 1, str(split).zfill(8))
+
+
+# Define function for finding every run with a complete set of input csv files
+# Replaces the hard-coded skips in cf8_rpo_mixsiar.R: a run is used when its mix, source
+# and discr files all exist and the mixture has every tracer value
+
+# path = cf8_rpo_mixsiar directory
+# include_bulk = also return the bulk (split "bulk") runs
+# Returns sorted list of (depth, split), with depth an int and split an int or "bulk"
+def find_runs(path='.', include_bulk=True, iso_names=ISO_NAMES):
+
+    runs = []
+    for mix_file in glob.glob(path + '/mix/mix_depth_*_split_*.csv'):
+        match = re.fullmatch(r'mix_depth_(\d+)_split_(\w+)\.csv', os.path.basename(mix_file))
+        if match is None:
+            continue
+
+        depth = int(match.group(1))
+        split = int(match.group(2)) if match.group(2).isdigit() else match.group(2)
+        if split == 'bulk' and not include_bulk:
+            continue
+
+        run_name = _run_name(depth, split)
+        if not (
+            os.path.exists(path + '/source/source_' + run_name + '.csv')
+            and os.path.exists(path + '/discr/discr_' + run_name + '.csv')
+        ):
+            continue
+        if np.isnan(load_mix_data(mix_file, iso_names)).any():
+            continue
+
+        runs.append((depth, split))
+
+    return sorted(runs, key=_run_order)
+
+
+# Define function for saving a run result to a .npz file
+# Writes to a temporary file first so an interrupted batch never leaves a partial file
+def save_result(result, filename):
+
+    tmp_path = filename + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **{key: np.asarray(value) for key, value in result.items()})
+    os.replace(tmp_path, filename)
+
+
+# Define function for loading a run result saved with save_result
+def load_result(filename):
+
+    with np.load(filename) as saved:
+        result = {key: saved[key] for key in saved.files}
+
+    result['source_names'] = result['source_names'].tolist()
+    for key, value in result.items():
+        if isinstance(value, np.ndarray) and value.ndim == 0:
+            result[key] = value.item()
+
+    return result
+
+
+# Define function for the content hash of a run
+# Hashes the bytes of the run's mix, source and discr csv files together with the run
+# seed and every run_model setting (prior, run length), so a checkpoint is reused only
+# when none of them changed
+def run_key(depth, split, path, run_seed, model_kwargs):
+
+    settings = {
+        name: parameter.default
+        for name, parameter in inspect.signature(run_model).parameters.items()
+        if parameter.default is not inspect.Parameter.empty and name != 'seed'
+    }
+    settings.update(model_kwargs)
+    settings['alpha'] = np.atleast_1d(np.asarray(settings['alpha'], dtype=float)).tolist()
+    settings['seed'] = run_seed
+    settings['version'] = _CHECKPOINT_VERSION
+
+    key = hashlib.sha256()
+    run_name = _run_name(depth, split)
+    for folder in ('mix', 'source', 'discr'):
+        with open(path + '/' + folder + '/' + folder + '_' + run_name + '.csv', 'rb') as f:
+            key.update(hashlib.sha256(f.read()).digest())
+    key.update(json.dumps(settings, sort_keys=True).encode())
+
+    return key.hexdigest()
+
+
+# Define function for the checkpoint file of a run
+# key = content hash of the run (None matches checkpoints of any hash)
+def checkpoint_path(depth, split, checkpoint_dir, key=None):
+
+    tag = '*' if key is None else key[:16]
+
+    return os.path.join(checkpoint_dir, 'run_' + _run_name(depth, split) + '.' + tag + '.npz')
+
+
+# Define function for the seed of a run
+# Run seeds are derived from (seed, depth, split), so results do not depend on the
+# order in which workers finish
+def _run_seed(seed, depth, split):
+
+    return [seed, int(depth), int(split) if str(split).isdigit() else 0]
+
+
+# Define function for running one batch run and writing its checkpoint
+# Older checkpoints of the same run (different content hash) are removed
+def _run_task(depth, split, path, checkpoint_dir, seed, key, model_kwargs):
+
+    result = run_model(*load_run(depth, split, path), seed=_run_seed(seed, depth, split), **model_kwargs)
+
+    for old_path in glob.glob(checkpoint_path(depth, split, checkpoint_dir)):
+        os.remove(old_path)
+    save_result(result, checkpoint_path(depth, split, checkpoint_dir, key))
+
+    return result
+
+
+# Run the mixing model for every depth x CO2 split across a process pool
+# Each finished run is checkpointed to checkpoint_dir under the content hash of its
+# inputs (see run_key). An interrupted batch resumes from the runs still missing, and
+# after editing an input csv file only the runs reading that file are re-run
+
+# runs = list of (depth, split) (None uses find_runs(path))
+# path = cf8_rpo_mixsiar directory
+# checkpoint_dir = folder for the run checkpoints (relative to path)
+# workers = number of worker processes (1 runs serially in this process)
+# resume = reuse checkpoints with matching content hashes instead of re-running them
+# seed = base random seed
+# model_kwargs = keyword arguments of run_model (alpha, n_draws, n_post, adaptive, ...)
+# Returns dictionary of run results keyed by (depth, split)
+def run_batch(
+    runs=None, path='.', checkpoint_dir=CHECKPOINT_DIR, workers=1, resume=True, seed=0,
+    **model_kwargs
+):
+
+    if runs is None:
+        runs = find_runs(path)
+
+    checkpoint_dir = os.path.join(path, checkpoint_dir)
+    os.makedirs(checkpoint_dir, exist_ok=True)
+
+    results = {}
+    todo = []
+    for depth, split in runs:
+        key = run_key(depth, split, path, _run_seed(seed, depth, split), model_kwargs)
+        checkpoint = checkpoint_path(depth, split, checkpoint_dir, key)
+        if resume and os.path.exists(checkpoint):
+            results[(depth, split)] = load_result(checkpoint)
+        else:
+            todo.append((depth, split, key))
+
+    if workers <= 1 or len(todo) < 2:
+        for depth, split, key in todo:
+            results[(depth, split)] = _run_task(depth, split, path, checkpoint_dir, seed, key, model_kwargs)
+    else:
+        # fork keeps the worker start-up cheap; other platforms fall back to their
+        # default start method
+        if 'fork' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('fork')
+        else:
+            context = multiprocessing.get_context()
+
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            tasks = {
+                pool.submit(_run_task, depth, split, path, checkpoint_dir, seed, key, model_kwargs): (depth, split)
+                for depth, split, key in todo
+            }
+            for task in as_completed(tasks):
+                results[tasks[task]] = task.result()
+
+    return {run: results[run] for run in sorted(results, key=_run_order)}
+
+
+# Define function for collecting the summary statistics of a batch into one table
+# results = output of run_batch
+# qs = quantiles
+# Returns long-format DataFrame with columns depth, split, source, Mean, SD and quantiles
+def batch_summary(results, qs=SUMMARY_QUANTILES):
+
+    tables = []
+    for (depth, split), result in results.items():
+        summary = summary_statistics(result, qs)
+        summary.insert(0, 'source', result['source_names'])
+        summary.insert(0, 'split', str(split))
+        summary.insert(0, 'depth', depth)
+        tables.append(summary.reset_index(drop=True))
+
+    return pd.concat(tables, ignore_index=True)
+
+
+## Source parameter sensitivity
+
+# Define function for a grid of source parameter scenarios
+# values = dictionary of '<source>.<column>' (e.g. 'aquatic.Meand13C'): values to try
+# Returns DataFrame with one scenario (row) per combination of values
+def grid_scenarios(values):
+
+    columns = list(values)
+    mesh = np.meshgrid(*[np.asarray(values[column], dtype=float) for column in columns], indexing='ij')
+
+    return pd.DataFrame({column: grid.ravel() for column, grid in zip(columns, mesh)})
+
+
+# Define function for a random sample of source parameter scenarios
+# ranges = dictionary of '<source>.<column>': (low, high) uniform sampling range
+# n = number of scenarios
+# seed = random seed
+# Returns DataFrame with one scenario (row) per draw
+def sample_scenarios(ranges, n, seed=0):
+
+    rng = np.random.default_rng(seed)
+
+    return pd.DataFrame({
+        column: rng.uniform(low, high, size=n) for column, (low, high) in ranges.items()
+    })
+
+
+# Define function for the (scenario x source x tracer) source means and SDs of a run
+# Scenario columns '<source>.Mean<tracer>' and '<source>.SD<tracer>' replace the csv
+# values; sources a run does not have are ignored (sweep_sources checks that every
+# scenario source is in at least one run)
+def _scenario_sources(scenarios, source, iso_names):
+
+    n_scenarios = len(scenarios)
+    means = np.repeat(source['means'][None], n_scenarios, axis=0)
+    sds = np.repeat(source['sds'][None], n_scenarios, axis=0)
+
+    for column in scenarios.columns:
+        name, _, field = column.partition('.')
+        if field.startswith('Mean') and field[4:] in iso_names:
+            target, j = means, iso_names.index(field[4:])
+        elif field.startswith('SD') and field[2:] in iso_names:
+            target, j = sds, iso_names.index(field[2:])
+        else:
+            raise ValueError(
+                'Scenario columns must be <source>.Mean<tracer> or <source>.SD<tracer>, not ' + column
+            )
+        if name in source['source_names']:
+            target[:, source['source_names'].index(name), j] = scenarios[column].to_numpy(dtype=float)
+
+    return means, sds
+
+
+# Define function for weighted summary statistics of shared draws under many scenarios
+# Quantiles are read from weighted histograms of each proportion (n_bins bins on [0, 1],
+# linear within a bin), which bincount builds for every scenario at once
+# p = (draw x source) proportions
+# bins = (draw x source) histogram bin of each proportion
+# log_w = (scenario x draw) log importance weights
+# qs = quantiles
+# n_bins = number of histogram bins
+# Returns (scenario x source x statistic) Mean, SD and quantiles, and (scenario,) ESS
+def _weighted_summaries(p, bins, log_w, qs, n_bins):
+
+    n_scenarios = len(log_w)
+    weights = np.exp(log_w - log_w.max(axis=1, keepdims=True))
+    weights /= weights.sum(axis=1, keepdims=True)
+
+    mean = weights @ p
+    sd = np.sqrt(np.maximum(weights @ p**2 - mean**2, 0))
+
+    summaries = np.empty((n_scenarios, p.shape[1], 2 + len(qs)))
+    summaries[:, :, 0] = mean
+    summaries[:, :, 1] = sd
+
+    # Offsetting each scenario's CDF by its row number makes the whole array sorted, so
+    # one searchsorted finds the quantile bins of every scenario
+    offsets = np.arange(n_scenarios)[:, None]
+    targets = np.asarray(qs)[None, :] + offsets
+    for k in range(p.shape[1]):
+        hist = np.bincount(
+            (offsets*n_bins + bins[:, k]).ravel(), weights=weights.ravel(),
+            minlength=n_scenarios*n_bins
+        ).reshape(n_scenarios, n_bins)
+        cdf = np.cumsum(hist, axis=1)
+        idx = np.searchsorted((cdf + offsets).ravel(), targets.ravel()).reshape(targets.shape)
+        idx = np.minimum(idx - offsets*n_bins, n_bins - 1)
+
+        upper = np.take_along_axis(cdf, idx, axis=1)
+        mass = np.take_along_axis(hist, idx, axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            within = np.where(mass > 0, 1 - (upper - np.asarray(qs))/mass, 0.5)
+        summaries[:, k, 2:] = (idx + np.clip(within, 0, 1))/n_bins
+
+    return summaries, 1/np.sum(weights**2, axis=1)
+
+
+# Define function for the weighted summaries of one run under every scenario
+# p = (draw x source) prior proportions
+# chisq = (draw x source x tracer) chisq(n) precision variates
+# mix, source, discr = see load_run
+# means, sds = (scenario x source x tracer) source means (discrimination added) and SDs
+# Returns (scenario x source x statistic) summaries and (scenario,) ESS
+def _sweep_run(p, chisq, mix, source, discr, means, sds, qs, n_bins, chunk_size):
+
+    n_scenarios = len(means)
+    n_draws = len(p)
+    bins = np.minimum((p*n_bins).astype(int), n_bins - 1)
+
+    # Same model as _log_likelihood, split so each scenario only needs matrix products:
+    # mixture variance = sum(p^2*SD^2*((n-1)/chisq + 1/n)) + sum(p^2*discr SD^2)
+    n = source['n'][:, None]
+    var_factor = p[:, :, None]**2*((n - 1)/chisq + 1/n)
+    discr_var = p**2 @ discr['sds']**2
+
+    summaries = np.empty((n_scenarios, p.shape[1], 2 + len(qs)))
+    ess = np.empty(n_scenarios)
+
+    step = max(1, chunk_size // n_draws)
+    for start in range(0, n_scenarios, step):
+        stop = min(start + step, n_scenarios)
+
+        # Constant terms are left out; they cancel when the weights are normalized
+        log_w = np.zeros((stop - start, n_draws))
+        for j in range(mix.shape[1]):
+            mix_var = sds[start:stop, :, j]**2 @ var_factor[:, :, j].T
+            mix_var += discr_var[:, j]
+            log_w -= 0.5*len(mix)*np.log(mix_var)
+            for mix_point in mix[:, j]:
+                # p sums to 1, so mixture - sum(p*means) = sum(p*(mixture - means))
+                resid = (mix_point - means[start:stop, :, j]) @ p.T
+                resid **= 2
+                resid /= mix_var
+                log_w -= 0.5*resid
+
+        summaries[start:stop], ess[start:stop] = _weighted_summaries(p, bins, log_w, qs, n_bins)
+
+    return summaries, ess
+
+
+# Run a batched source parameter sensitivity sweep
+# Every scenario is solved for every depth x CO2 split by importance sampling with common
+# random numbers: each run draws its prior proportions and chisq(n) precision variates
+# once, and only the likelihood weights are recomputed for each scenario. Differences
+# between scenarios are therefore not blurred by Monte Carlo noise
+# Like run_model(adaptive=True), each run adds prior draws until the smallest ESS over
+# the scenarios reaches ess_target (or max_draws is used, with a warning)
+
+# scenarios = DataFrame of '<source>.Mean<tracer>' / '<source>.SD<tracer>' columns, one
+#             row per scenario (see grid_scenarios, sample_scenarios); other source
+#             parameters keep their csv values
+# runs = list of (depth, split) (None uses find_runs(path))
+# path = cf8_rpo_mixsiar directory
+# alpha = Dirichlet prior (scalar or one value per source)
+# n_draws = initial number of shared prior draws per run
+# qs = quantiles
+# seed = base random seed
+# n_bins = histogram bins used for the quantiles (resolution 1/n_bins)
+# chunk_size = approximate number of (scenario x draw) values held at once
+# ess_target = smallest ESS accepted for any scenario of a run (0 uses n_draws as is)
+# max_draws = largest number of prior draws per run
+# Returns dictionary of 'summaries' (scenario x depth x split x source x statistic) array
+# (NaN where a run or source does not exist), 'ess' (scenario x depth x split) importance
+# sampling effective sample sizes, 'n_draws' (depth x split) prior draws used, and the
+# 'depths', 'splits', 'sources', 'statistics' and 'scenarios' labelling each axis
+def sweep_sources(
+    scenarios, runs=None, path='.', alpha=1, n_draws=20000, qs=SUMMARY_QUANTILES,
+    seed=0, n_bins=2000, chunk_size=2**22, ess_target=5000, max_draws=2000000,
+    iso_names=ISO_NAMES
+):
+
+    scenarios = pd.DataFrame(scenarios).reset_index(drop=True)
+    iso_names = list(iso_names)
+    if runs is None:
+        runs = find_runs(path)
+
+    loaded = {run: load_run(*run, path, iso_names) for run in runs}
+
+    depths = sorted({int(depth) for depth, split in runs})
+    splits = [split for _, split in sorted({(0, split) for _, split in runs}, key=_run_order)]
+    sources = []
+    for mix, source, discr in loaded.values():
+        sources += [name for name in source['source_names'] if name not in sources]
+    unknown = sorted({column.partition('.')[0] for column in scenarios.columns} - set(sources))
+    if unknown:
+        raise ValueError(
+            'Scenario sources not in any selected run: ' + ', '.join(unknown)
+            + ' (sources are ' + ', '.join(sources) + ')'
+        )
+    statistics = ['Mean', 'SD'] + [f'{q:.1%}'.replace('.0%', '%') for q in qs]
+
+    n_scenarios = len(scenarios)
+    summaries = np.full((n_scenarios, len(depths), len(splits), len(sources), len(statistics)), np.nan)
+    ess = np.full((n_scenarios, len(depths), len(splits)), np.nan)
+    draws_used = np.zeros((len(depths), len(splits)), dtype=int)
+
+    for (depth, split), (mix, source, discr) in loaded.items():
+        n_sources = len(source['source_names'])
+        run_alpha = np.broadcast_to(np.asarray(alpha, dtype=float), (n_sources,))
+        rng = np.random.default_rng(_run_seed(seed, depth, split))
+
+        means, sds = _scenario_sources(scenarios, source, iso_names)
+        means = means + discr['means']
+
+        # Grow the shared draws (keeping those already made) until every scenario has
+        # ess_target, scaling by the ESS per draw seen so far
+        p = np.empty((0, n_sources))
+        chisq = np.empty((0,) + source['sds'].shape)
+        target = min(n_draws, max_draws)
+        while True:
+            n_new = target - len(p)
+            p = np.concatenate([p, rng.dirichlet(run_alpha, size=n_new)])
+            chisq = np.concatenate([chisq, rng.chisquare(source['n'][:, None], size=(n_new,) + source['sds'].shape)])
+            run_summaries, run_ess = _sweep_run(p, chisq, mix, source, discr, means, sds, qs, n_bins, chunk_size)
+
+            min_ess = run_ess.min()
+            if min_ess >= ess_target or len(p) >= max_draws:
+                break
+            target = min(max_draws, int(np.ceil(1.2*len(p)*ess_target/max(min_ess, 1))))
+
+        if min_ess < ess_target:
+            warnings.warn(
+                f'{_run_name(depth, split)}: smallest scenario ESS is {min_ess:.0f} with '
+                f'{len(p)} draws (ess_target={ess_target}); increase max_draws'
+            )
+
+        d = depths.index(int(depth))
+        s = [str(split_) for split_ in splits].index(str(split))
+        k = [sources.index(name) for name in source['source_names']]
+        summaries[:, d, s][:, k] = run_summaries
+        ess[:, d, s] = run_ess
+        draws_used[d, s] = len(p)
+
+    return {
+        'summaries': summaries,
+        'ess': ess,
+        'n_draws': draws_used,
+        'depths': depths,
+        'splits': splits,
+        'sources': sources,
+        'statistics': statistics,
+        'scenarios': scenarios,
+    }
+
+
+## Prior sensitivity
+
+# Pareto k above which reweighted results are unreliable and the model should be refit
+# (Vehtari et al., 2024, Pareto smoothed importance sampling)
+PARETO_K_THRESHOLD = 0.7
+
+
+# Define function for fitting generalized Pareto distributions to many sets of
+# exceedances at once (Zhang & Stephens, 2009, with the weakly informative prior on k
+# used by the R loo package)
+# x = (set x exceedance) exceedances over the cutoff, sorted ascending along each row
+# Returns (set,) shape k and (set,) scale sigma
+def _gpd_fit(x):
+
+    n = x.shape[1]
+    m = 30 + int(np.sqrt(n))
+
+    b = 1 - np.sqrt(m/(np.arange(1, m + 1) - 0.5))
+    b = b[None, :]/(3*x[:, [int(n/4 + 0.5) - 1]]) + 1/x[:, [-1]]
+    k = np.log1p(-b[:, :, None]*x[:, None, :]).mean(axis=2)
+    len_scale = n*(np.log(-b/k) - k - 1)
+
+    weights = 1/np.exp(len_scale[:, None, :] - len_scale[:, :, None]).sum(axis=2)
+    weights /= weights.sum(axis=1, keepdims=True)
+    b_post = (b*weights).sum(axis=1)
+
+    k_post = np.log1p(-b_post[:, None]*x).mean(axis=1)
+    sigma = -k_post/b_post
+    k_post = (n*k_post + 10*0.5)/(n + 10)
+
+    return k_post, sigma
+
+
+# Define function for Pareto smoothing many sets of log importance weights at once
+# The largest min(n/5, 3*sqrt(n)) weights of each set are replaced by the expected order
+# statistics of a generalized Pareto distribution fitted to them
+# log_w = (set x draw) log importance weights
+# Returns (set x draw) smoothed, normalized log weights and (set,) Pareto k (inf when
+# there are too few draws to fit)
+def _psis(log_w):
+
+    n_sets, n_draws = log_w.shape
+    n_tail = int(np.ceil(min(0.2*n_draws, 3*np.sqrt(n_draws))))
+
+    log_w = log_w - log_w.max(axis=1, keepdims=True)
+
+    # Too few draws to fit a tail (e.g. a single kept proposal draw): no smoothing, and
+    # k = inf so the result is flagged for a refit
+    if n_draws <= n_tail:
+        log_w -= np.log(np.exp(log_w).sum(axis=1, keepdims=True))
+        return log_w, np.full(n_sets, np.inf)
+    order = np.argsort(log_w, axis=1)
+    tail_idx = order[:, -n_tail:]
+    cutoff = np.take_along_axis(log_w, order[:, [-n_tail - 1]], axis=1)
+    cutoff = np.maximum(cutoff, np.log(np.finfo(float).tiny))
+
+    tail = np.exp(np.take_along_axis(log_w, tail_idx, axis=1)) - np.exp(cutoff)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        k, sigma = _gpd_fit(tail)
+
+        # Expected order statistics of the fitted tail, capped at the largest raw weight
+        probs = (np.arange(n_tail) + 0.5)/n_tail
+        smoothed = np.where(
+            np.abs(k[:, None]) > 1e-12,
+            sigma[:, None]*np.expm1(-k[:, None]*np.log1p(-probs))/k[:, None],
+            -sigma[:, None]*np.log1p(-probs),
+        )
+        smoothed = np.minimum(np.log(smoothed + np.exp(cutoff)), 0)
+
+    # Equal weights (e.g. the original prior) have no tail to smooth
+    flat = tail[:, -1] <= 0
+    k[flat] = 0
+
+    finite = np.isfinite(k) & ~flat
+    rows = np.nonzero(finite)[0][:, None]
+    log_w[rows, tail_idx[finite]] = smoothed[finite]
+
+    log_w_max = log_w.max(axis=1, keepdims=True)
+    log_w -= log_w_max + np.log(np.exp(log_w - log_w_max).sum(axis=1, keepdims=True))
+
+    return log_w, k
+
+
+# Define function for reweighting the posterior draws of one run to new Dirichlet priors
+# The log density ratio of a new to the original Dirichlet prior at each draw is
+# sum((alpha_new - alpha)*log(p)) (normalizing constants cancel), computed for every
+# new prior at once and Pareto smoothed
+# Importance runs are reweighted from their unresampled proposal draws (the ratio is
+# added to their log weights), since resampled draws repeat and would overstate Pareto k
+# and ESS; grid runs are reweighted from their equally weighted (distinct) draws
+
+# result = output of run_model (or load_result)
+# alphas = (prior,) scalars or (prior x source) array of new Dirichlet priors
+# qs = quantiles
+# n_bins = histogram bins used for the quantiles (see _weighted_summaries)
+# Returns dictionary of 'summaries' (prior x source x statistic) reweighted Mean, SD and
+# quantiles, 'pareto_k' and 'ess' of each prior, 'refit' (pareto_k > PARETO_K_THRESHOLD:
+# the reweighted results are unreliable and the model should be rerun with that prior),
+# and the 'alphas', 'sources' and 'statistics' labelling each axis
+def reweight_prior(result, alphas, qs=SUMMARY_QUANTILES, n_bins=2000):
+
+    if 'log_weights' in result:
+        draws = np.asarray(result['proposal_draws'], dtype=float)
+        base_log_w = np.asarray(result['log_weights'], dtype=float)
+    else:
+        draws = np.asarray(result['draws'], dtype=float)
+        base_log_w = np.zeros(len(draws))
+    n_sources = draws.shape[1]
+    alphas = np.asarray(alphas, dtype=float)
+    alphas = np.broadcast_to(alphas.reshape(len(alphas), -1), (len(alphas), n_sources))
+
+    log_p = np.log(np.maximum(draws, np.finfo(float).tiny))
+    log_w, pareto_k = _psis(base_log_w + (alphas - np.asarray(result['alpha'], dtype=float)) @ log_p.T)
+
+    bins = np.minimum((draws*n_bins).astype(int), n_bins - 1)
+    summaries, ess = _weighted_summaries(draws, bins, log_w, qs, n_bins)
+
+    return {
+        'summaries': summaries,
+        'pareto_k': pareto_k,
+        'ess': ess,
+        'refit': ~(pareto_k <= PARETO_K_THRESHOLD),
+        'alphas': alphas,
+        'sources': list(result['source_names']),
+        'statistics': ['Mean', 'SD'] + [f'{q:.1%}'.replace('.0%', '%') for q in qs],
+    }
+
+
+# Define function for prior sensitivity of a whole batch
+# results = output of run_batch
+# alphas = list of scalar Dirichlet priors, or DataFrame with one column per source name
+#          and one row per prior (sources missing from the columns keep alpha = 1)
+# qs, n_bins = see reweight_prior
+# Returns long-format DataFrame with columns prior (row of alphas), depth, split, source,
+# alpha, Mean, SD, quantiles, pareto_k, ess and refit
+def prior_sensitivity(results, alphas, qs=SUMMARY_QUANTILES, n_bins=2000):
+
+    if not isinstance(alphas, pd.DataFrame):
+        alphas = pd.DataFrame({'alpha': np.asarray(alphas, dtype=float)})
+
+    tables = []
+    for (depth, split), result in results.items():
+        names = list(result['source_names'])
+        if list(alphas.columns) == ['alpha']:
+            run_alphas = np.repeat(alphas[['alpha']].to_numpy(), len(names), axis=1)
+        else:
+            run_alphas = alphas.reindex(columns=names).fillna(1).to_numpy(dtype=float)
+
+        reweighted = reweight_prior(result, run_alphas, qs, n_bins)
+        n_priors = len(run_alphas)
+
+        table = pd.DataFrame(
+            reweighted['summaries'].reshape(n_priors*len(names), -1),
+            columns=reweighted['statistics'],
+        )
+        table.insert(0, 'alpha', run_alphas.ravel())
+        table.insert(0, 'source', np.tile(names, n_priors))
+        table.insert(0, 'split', str(split))
+        table.insert(0, 'depth', depth)
+        table.insert(0, 'prior', np.repeat(np.arange(n_priors), len(names)))
+        for key in ('pareto_k', 'ess', 'refit'):
+            table[key] = np.repeat(reweighted[key], len(names))
+        tables.append(table)
+
+    return pd.concat(tables, ignore_index=True)
+
+
+### EXAMPLE: SAME RUN AS THE cf8_rpo_mixsiar.R EXAMPLE SCRIPT ###
+
+# CF817-03 depth 1 (5-6.5 cm), CO2 split 1 (lowest temperature)
+# Run from the cf8_rpo_mixsiar directory
+if __name__ == '__main__':
+
+    mix, source, discr = load_run(1, 1)
+    result = run_model(mix, source, discr, alpha=1)
+
+    print(summary_statistics(result).round(3))
+
+
+    ### RUN ALL CO2 SPLITS FOR ALL DEPTHS ###
+
+    # Runs are found from the input csv files; finished runs are kept in python_output/
+    # and only re-run when their input csv files or model settings change
+    results = run_batch(workers=os.cpu_count())
+
+    print(batch_summary(results).round(3).to_string())
+
+
+    ### PRIOR SENSITIVITY ###
+
+    # Reweight every run to alternative uniform Dirichlet priors; runs flagged in the refit
+    # column need a new run_batch(alpha=...) for that prior
+    sensitivity = prior_sensitivity(results, [0.5, 2])
+
+    print(sensitivity.round(3).to_string())